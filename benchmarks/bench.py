@@ -0,0 +1,435 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# MIT License
+#
+# Copyright (c) 2023 Iñaki Amatria-Barral
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Benchmarks every route of pCarrot against a throwaway MySQL-compatible
+# database (a local MySQL or MariaDB, never the production one: --seed drops
+# and recreates the forgottenserver tables it needs)
+#
+#   python benchmarks/bench.py --seed
+#   python benchmarks/bench.py --save-baseline
+#   python benchmarks/bench.py --compare
+
+import os
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+import tempfile
+import threading
+import urllib.parse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from pCarrot import create_app
+from pCarrot.db import get_db
+from pCarrot.db import init_db
+from pCarrot.migrate import split_sql
+from pCarrot.news import render_news
+from pCarrot.cache import cache
+from pCarrot.status import STATUS_KEY
+from pCarrot.model import refresh_guilds
+from pCarrot.model import refresh_highscores
+from pCarrot.metrics import metrics
+
+BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+PASSWORD = "benchmark"
+# Registered account names must not clash with the ones of previous runs
+RUN_ID = f"{int(time.time()) % 10**6:06d}"
+
+def create_bench_app(args):
+    app = create_app({
+        "TESTING": True,
+        "SECRET_KEY": "benchmark",
+        "WTF_CSRF_ENABLED": False,
+        "OT_STATUS_POLLER": False,
+        # Every route would end up timing its 429 page otherwise
+        "OT_RATE_LIMIT": False,
+        "OT_DATABASE_HOST": args.db_host,
+        "OT_DATABASE_USER": args.db_user,
+        "OT_DATABASE_PASSWORD": args.db_password,
+        "OT_DATABASE_NAME": args.db_name,
+        "OT_DATABASE_POOL_MAX_SIZE": args.clients,
+        "CACHE_DIR": tempfile.mkdtemp(prefix="pcarrot-bench-cache-"),
+        "CACHE_DURABLE_DIR": tempfile.mkdtemp(prefix="pcarrot-bench-durable-"),
+        "OT_METRICS_DIR": tempfile.mkdtemp(prefix="pcarrot-bench-metrics-")
+    })
+    # No poller runs, the status pages read this snapshot instead
+    with app.app_context():
+        cache.durable.set(STATUS_KEY, {
+            "online": True,
+            "uptime": 86400,
+            "players_online": 100,
+            "players_max": 1000,
+            "players_peak": 250,
+            "players": [(f"Player {i}", 100 + i) for i in range(100)],
+            "updated": time.time()
+        }, timeout=0)
+    return app
+
+def _execute_file(db, path):
+    with open(path, encoding="utf-8") as f:
+        for statement in split_sql(f.read()):
+            with db.cursor() as cursor:
+                cursor.execute(statement)
+    db.commit()
+
+def seed(app, args):
+    rng = random.Random(0)
+    password = hashlib.sha1(PASSWORD.encode("utf-8")).hexdigest()
+    now = int(time.time())
+    with app.app_context():
+        db = get_db()
+        _execute_file(db, os.path.join(os.path.dirname(__file__), "seed.sql"))
+        init_db()
+
+        with db.cursor() as cursor:
+            for start in range(0, args.accounts, 5000):
+                cursor.executemany(
+                    "INSERT INTO `accounts` (`name`, `password`, `creation`)"
+                    " VALUES (%s, %s, %s)",
+                    [
+                        (f"bench{i}", password, now)
+                        for i in range(start, min(start + 5000, args.accounts))
+                    ]
+                )
+                db.commit()
+
+            for start in range(0, args.players, 5000):
+                rows = []
+                for i in range(start, min(start + 5000, args.players)):
+                    level = rng.randint(8, 400)
+                    rows.append((
+                        f"Player {i}",
+                        rng.randint(1, args.accounts),
+                        level,
+                        rng.randint(1, 8),
+                        level ** 3 * 50 // 3,
+                        rng.randint(0, 120),
+                        rng.randint(10, 120),
+                        rng.randint(10, 120),
+                        now - rng.randint(0, 86400 * 30)
+                    ))
+                cursor.executemany(
+                    "INSERT INTO `players` (`name`, `account_id`, `level`,"
+                    " `vocation`, `experience`, `maglevel`, `skill_sword`,"
+                    " `skill_shielding`, `lastlogin`)"
+                    " VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)",
+                    rows
+                )
+                db.commit()
+
+            for start in range(0, args.deaths, 5000):
+                rows = []
+                for i in range(start, min(start + 5000, args.deaths)):
+                    is_player = rng.random() < 0.2
+                    killer = (
+                        f"Player {rng.randrange(args.players)}" if is_player
+                        else rng.choice(("a rat", "a dragon", "a demon"))
+                    )
+                    rows.append((
+                        rng.randint(1, args.players),
+                        now - rng.randint(0, 86400 * 30),
+                        rng.randint(8, 400),
+                        killer,
+                        is_player,
+                        killer,
+                        is_player
+                    ))
+                cursor.executemany(
+                    "INSERT INTO `player_deaths` (`player_id`, `time`,"
+                    " `level`, `killed_by`, `is_player`, `mostdamage_by`,"
+                    " `mostdamage_is_player`)"
+                    " VALUES (%s, %s, %s, %s, %s, %s, %s)",
+                    rows
+                )
+                db.commit()
+
+            # Guild i is owned by player i + 1, the other players are spread
+            # over the guilds until they run out
+            guilds = min(args.guilds, args.players)
+            members = args.players // max(guilds, 1)
+            for i in range(guilds):
+                cursor.execute(
+                    "INSERT INTO `guilds` (`name`, `ownerid`, `creationdata`)"
+                    " VALUES (%s, %s, %s)",
+                    (f"Guild {i}", i + 1, now)
+                )
+                guild_id = cursor.lastrowid
+                rank_ids = []
+                for level, name in ((3, "Leader"), (2, "Vice"), (1, "Member")):
+                    cursor.execute(
+                        "INSERT INTO `guild_ranks` (`guild_id`, `name`,"
+                        " `level`) VALUES (%s, %s, %s)",
+                        (guild_id, name, level)
+                    )
+                    rank_ids.append(cursor.lastrowid)
+                cursor.executemany(
+                    "INSERT INTO `guild_membership` (`player_id`, `guild_id`,"
+                    " `rank_id`) VALUES (%s, %s, %s)",
+                    [
+                        (i + 1, guild_id, rank_ids[0])
+                    ] + [
+                        (player_id, guild_id, rank_ids[1 + (player_id % 4 > 0)])
+                        for player_id in range(
+                            guilds + i * members + 1,
+                            min(guilds + (i + 1) * members, args.players) + 1
+                        )
+                    ]
+                )
+            db.commit()
+
+            cursor.executemany(
+                "INSERT INTO `pcarrot_news` (`title`, `body`, `date`)"
+                " VALUES (%s, %s, NOW() - INTERVAL %s MINUTE)",
+                [
+                    (
+                        f"News {i}",
+                        f"# News {i}\n\n" + "Some *markdown* text. " * 40,
+                        args.news - i
+                    )
+                    for i in range(args.news)
+                ]
+            )
+            db.commit()
+
+        render_news()
+        refresh_highscores(app.config["OT_HIGHSCORES_MAX_GROUP_ID"])
+        refresh_guilds()
+
+def _login(client, account):
+    client.post(
+        "/login",
+        data={"account_name": account, "password": PASSWORD}
+    )
+
+def _player(args, i):
+    return urllib.parse.quote(f"Player {i % args.players}")
+
+# Each route is a callable taking a test client and a request number.
+# /deaths/stream is left out on purpose: every viewer holds a worker (or a
+# thread of one) for as long as it stays connected, so its cost is how many
+# viewers a deployment can hold, not requests per second
+ROUTES = {
+    "GET /": lambda client, args, i: client.get("/"),
+    "GET /highscores": lambda client, args, i: client.get(
+        f"/highscores?page={i % 20 + 1}"
+    ),
+    "GET /status": lambda client, args, i: client.get("/status"),
+    "GET /news": lambda client, args, i: client.get("/news"),
+    "GET /news?q": lambda client, args, i: client.get(
+        f"/news?q=news+{i % args.news}"
+    ),
+    "GET /character": lambda client, args, i: client.get(
+        f"/character/{_player(args, i)}"
+    ),
+    "GET /deaths": lambda client, args, i: client.get("/deaths"),
+    "GET /guilds": lambda client, args, i: client.get("/guilds"),
+    "GET /guild": lambda client, args, i: client.get(
+        "/guild/" + urllib.parse.quote(f"Guild {i % max(args.guilds, 1)}")
+    ),
+    "GET /api/v1/status": lambda client, args, i: client.get(
+        "/api/v1/status"
+    ),
+    "GET /api/v1/news": lambda client, args, i: client.get("/api/v1/news"),
+    "GET /api/v1/characters": lambda client, args, i: client.get(
+        f"/api/v1/characters?name={_player(args, i)},{_player(args, i + 1)}"
+    ),
+    "POST /login": lambda client, args, i: client.post(
+        "/login",
+        data={
+            "account_name": f"bench{i % args.accounts}",
+            "password": PASSWORD
+        }
+    ),
+    "POST /register": lambda client, args, i: client.post(
+        "/register",
+        data={
+            "account_name": f"r{RUN_ID}x{i}",
+            "password": PASSWORD,
+            "confirm_password": PASSWORD
+        }
+    ),
+    "GET /account": lambda client, args, i: client.get("/account")
+}
+
+def _counter(name, **labels):
+    snapshot = metrics.snapshot()
+    return sum(
+        value for n, l, value in snapshot["counters"]
+        if n == name and all(dict(l).get(k) == v for k, v in labels.items())
+    )
+
+def _percentile(samples, percentile):
+    index = min(int(len(samples) * percentile / 100), len(samples) - 1)
+    return samples[index]
+
+def run_route(app, args, route):
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    counter = iter(range(args.requests))
+
+    def client_loop():
+        client = app.test_client()
+        if route == "GET /account":
+            _login(client, f"bench{threading.get_ident() % args.accounts}")
+        samples = []
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                break
+            start = time.perf_counter()
+            response = ROUTES[route](client, args, i)
+            samples.append(time.perf_counter() - start)
+            if response.status_code >= 500:
+                errors.append(response.status_code)
+        with lock:
+            latencies.extend(samples)
+
+    # Warm up caches and pools so the numbers describe the steady state
+    warm_up = app.test_client()
+    if route == "GET /account":
+        _login(warm_up, "bench0")
+    ROUTES[route](warm_up, args, args.requests)
+
+    queries = _counter("pcarrot_sql_queries_total")
+    hits = _counter("pcarrot_cache_memoize_total", result="hit")
+    misses = _counter("pcarrot_cache_memoize_total", result="miss")
+
+    threads = [
+        threading.Thread(target=client_loop) for _ in range(args.clients)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    queries = _counter("pcarrot_sql_queries_total") - queries
+    hits = _counter("pcarrot_cache_memoize_total", result="hit") - hits
+    misses = _counter("pcarrot_cache_memoize_total", result="miss") - misses
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": len(errors),
+        "throughput": len(latencies) / elapsed,
+        "p50": _percentile(latencies, 50),
+        "p95": _percentile(latencies, 95),
+        "p99": _percentile(latencies, 99),
+        # The login of GET /account clients is not part of the measure
+        "queries_per_request": queries / max(len(latencies), 1),
+        "cache_hit_ratio": hits / (hits + misses) if hits + misses else None
+    }
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for route, result in results.items():
+        reference = baseline.get(route)
+        if reference is None:
+            continue
+        if result["throughput"] < reference["throughput"] * (1 - tolerance):
+            regressions.append(
+                f"{route}: throughput {result['throughput']:.1f} req/s, "
+                f"baseline {reference['throughput']:.1f} req/s"
+            )
+        if result["p95"] > reference["p95"] * (1 + tolerance):
+            regressions.append(
+                f"{route}: p95 {result['p95'] * 1000:.2f} ms, "
+                f"baseline {reference['p95'] * 1000:.2f} ms"
+            )
+        if result["queries_per_request"] > reference["queries_per_request"]:
+            regressions.append(
+                f"{route}: {result['queries_per_request']:.2f} queries per "
+                f"request, baseline {reference['queries_per_request']:.2f}"
+            )
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark pCarrot routes.")
+    parser.add_argument("--db-host", default="127.0.0.1")
+    parser.add_argument("--db-user", default="root")
+    parser.add_argument("--db-password", default="")
+    parser.add_argument("--db-name", default="pcarrot_bench")
+    parser.add_argument("--seed", action="store_true",
+                        help="(Re)create and fill the benchmark database")
+    parser.add_argument("--accounts", type=int, default=100000)
+    parser.add_argument("--players", type=int, default=100000)
+    parser.add_argument("--news", type=int, default=5000)
+    parser.add_argument("--deaths", type=int, default=100000)
+    parser.add_argument("--guilds", type=int, default=1000)
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=2000,
+                        help="Requests per route")
+    parser.add_argument("--route", action="append", choices=list(ROUTES),
+                        help="Route to run, all of them by default")
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--compare", action="store_true",
+                        help="Fail if a route regressed from the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--baseline", default=BASELINE)
+    args = parser.parse_args()
+
+    app = create_bench_app(args)
+    if args.seed:
+        print(f"Seeding {args.db_name}...", flush=True)
+        seed(app, args)
+
+    results = {}
+    print(
+        f"{'route':<24} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+        f" {'q/req':>6} {'hit %':>6} {'errors':>6}"
+    )
+    for route in args.route or ROUTES:
+        result = results[route] = run_route(app, args, route)
+        hit_ratio = result["cache_hit_ratio"]
+        print(
+            f"{route:<24} {result['throughput']:>9.1f}"
+            f" {result['p50'] * 1000:>8.2f} {result['p95'] * 1000:>8.2f}"
+            f" {result['p99'] * 1000:>8.2f}"
+            f" {result['queries_per_request']:>6.2f}"
+            f" {'-' if hit_ratio is None else f'{hit_ratio * 100:.1f}':>6}"
+            f" {result['errors']:>6}",
+            flush=True
+        )
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=4, sort_keys=True)
+        print(f"Saved the baseline to {args.baseline}")
+
+    if args.compare:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+DROP TABLE IF EXISTS `pcarrot_migrations`;
+DROP TABLE IF EXISTS `pcarrot_news`;
+DROP TABLE IF EXISTS `pcarrot_highscores`;
+DROP TABLE IF EXISTS `pcarrot_highscores_state`;
+DROP TABLE IF EXISTS `pcarrot_guilds`;
+DROP TABLE IF EXISTS `pcarrot_guilds_state`;
+DROP TABLE IF EXISTS `guild_membership`;
+DROP TABLE IF EXISTS `guild_ranks`;
+DROP TABLE IF EXISTS `guilds`;
+DROP TABLE IF EXISTS `player_deaths`;
+DROP TABLE IF EXISTS `players_online`;
+DROP TABLE IF EXISTS `players`;
+DROP TABLE IF EXISTS `accounts`;
+
+CREATE TABLE `accounts` (
+    `id` INT UNSIGNED NOT NULL AUTO_INCREMENT,
+    `name` VARCHAR(32) NOT NULL,
+    `password` VARCHAR(255) NOT NULL,
+    `secret` CHAR(16) NULL,
+    `type` INT NOT NULL DEFAULT 1,
+    `premium_ends_at` INT UNSIGNED NOT NULL DEFAULT 0,
+    `email` VARCHAR(255) NOT NULL DEFAULT '',
+    `creation` INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (`id`),
+    UNIQUE KEY (`name`)
+) ENGINE=InnoDB DEFAULT CHARACTER SET=utf8;
+
+CREATE TABLE `players` (
+    `id` INT NOT NULL AUTO_INCREMENT,
+    `name` VARCHAR(255) NOT NULL,
+    `group_id` INT NOT NULL DEFAULT 1,
+    `account_id` INT UNSIGNED NOT NULL DEFAULT 0,
+    `level` INT NOT NULL DEFAULT 1,
+    `vocation` INT NOT NULL DEFAULT 0,
+    `sex` INT NOT NULL DEFAULT 0,
+    `experience` BIGINT UNSIGNED NOT NULL DEFAULT 0,
+    `maglevel` INT NOT NULL DEFAULT 0,
+    `lastlogin` BIGINT UNSIGNED NOT NULL DEFAULT 0,
+    `lastlogout` BIGINT UNSIGNED NOT NULL DEFAULT 0,
+    `deletion` BIGINT NOT NULL DEFAULT 0,
+    `skill_fist` INT UNSIGNED NOT NULL DEFAULT 10,
+    `skill_club` INT UNSIGNED NOT NULL DEFAULT 10,
+    `skill_sword` INT UNSIGNED NOT NULL DEFAULT 10,
+    `skill_axe` INT UNSIGNED NOT NULL DEFAULT 10,
+    `skill_dist` INT UNSIGNED NOT NULL DEFAULT 10,
+    `skill_shielding` INT UNSIGNED NOT NULL DEFAULT 10,
+    `skill_fishing` INT UNSIGNED NOT NULL DEFAULT 10,
+    PRIMARY KEY (`id`),
+    UNIQUE KEY (`name`),
+    KEY (`account_id`)
+) ENGINE=InnoDB DEFAULT CHARACTER SET=utf8;
+
+CREATE TABLE `players_online` (
+    `player_id` INT NOT NULL,
+    PRIMARY KEY (`player_id`)
+) ENGINE=MEMORY DEFAULT CHARACTER SET=utf8;
+
+CREATE TABLE `player_deaths` (
+    `player_id` INT NOT NULL,
+    `time` BIGINT UNSIGNED NOT NULL DEFAULT 0,
+    `level` INT NOT NULL DEFAULT 1,
+    `killed_by` VARCHAR(255) NOT NULL,
+    `is_player` TINYINT NOT NULL DEFAULT 1,
+    `mostdamage_by` VARCHAR(100) NOT NULL,
+    `mostdamage_is_player` TINYINT NOT NULL DEFAULT 0,
+    `unjustified` TINYINT NOT NULL DEFAULT 0,
+    `mostdamage_unjustified` TINYINT NOT NULL DEFAULT 0,
+    KEY (`player_id`),
+    KEY (`killed_by`),
+    KEY (`mostdamage_by`)
+) ENGINE=InnoDB DEFAULT CHARACTER SET=utf8;
+
+CREATE TABLE `guilds` (
+    `id` INT NOT NULL AUTO_INCREMENT,
+    `name` VARCHAR(255) NOT NULL,
+    `ownerid` INT NOT NULL,
+    `creationdata` INT NOT NULL,
+    `motd` VARCHAR(255) NOT NULL DEFAULT '',
+    PRIMARY KEY (`id`),
+    UNIQUE KEY (`name`),
+    UNIQUE KEY (`ownerid`)
+) ENGINE=InnoDB DEFAULT CHARACTER SET=utf8;
+
+CREATE TABLE `guild_ranks` (
+    `id` INT NOT NULL AUTO_INCREMENT,
+    `guild_id` INT NOT NULL,
+    `name` VARCHAR(255) NOT NULL,
+    `level` INT NOT NULL,
+    PRIMARY KEY (`id`),
+    KEY (`guild_id`)
+) ENGINE=InnoDB DEFAULT CHARACTER SET=utf8;
+
+CREATE TABLE `guild_membership` (
+    `player_id` INT NOT NULL,
+    `guild_id` INT NOT NULL,
+    `rank_id` INT NOT NULL,
+    `nick` VARCHAR(15) NOT NULL DEFAULT '',
+    PRIMARY KEY (`player_id`),
+    KEY (`guild_id`),
+    KEY (`rank_id`)
+) ENGINE=InnoDB DEFAULT CHARACTER SET=utf8;
@@ -24,9 +24,16 @@
 # SOFTWARE.
 
 import os
+import time
+
+# How long importing the package (Flask and its dependencies) took, before
+# create_app can even run
+_import_start = time.perf_counter()
 
 from flask import Flask
 
+_import_time = time.perf_counter() - _import_start
+
 __version__ = "0.0.0"
 __date__ = "April 2023"
 
@@ -37,22 +44,113 @@ __author__ = "Iñaki Amatria-Barral"
 __email__ = "i.amatria@udc.es"
 
 def create_app(test_config=None):
+    start = time.perf_counter()
     app = Flask(__name__, instance_relative_config=True)
     app.config.from_mapping(
         # OT realted config
         OT_SERVER_NAME="pCarrot",
         OT_SERVER_DESCRIPTION="A Python AAC for OpenTibia",
         OT_NUM_LATEST_NEWS=3,
+        OT_NEWS_PAGE_SIZE=10,
+        OT_NEWS_SEARCH_LIMIT=20,
+        # Searches are cached once a worker saw them this many times lately
+        OT_NEWS_SEARCH_CACHE_MIN_COUNT=3,
+        OT_HIGHSCORES_PAGE_SIZE=50,
+        OT_HIGHSCORES_MAX_GROUP_ID=1,
+        OT_VOCATIONS=[
+            "None",
+            "Sorcerer",
+            "Druid",
+            "Paladin",
+            "Knight",
+            "Master Sorcerer",
+            "Elder Druid",
+            "Royal Paladin",
+            "Elite Knight"
+        ],
+        OT_CHARACTER_DEATHS_DAYS=30,
+        OT_CHARACTER_SEARCH_MIN_LENGTH=2,
+        OT_CHARACTER_SEARCH_LIMIT=10,
+        OT_DEATHS_INTERVAL=5,
+        OT_DEATHS_BUFFER_SIZE=100,
+        OT_DEATHS_KEEPALIVE=15,
+        OT_API_MAX_NAMES=100,
+        OT_API_MAX_AGE=60,
+        OT_STATUS_HOST="localhost",
+        OT_STATUS_PORT=7171,
+        OT_STATUS_POLLER=True,
+        OT_STATUS_TIMEOUT=5,
+        OT_STATUS_INTERVAL=60,
+        OT_STATUS_MAX_BACKOFF=600,
+        # Each world is a dict with any of host, user, password, name,
+        # replicas and timeout, the rest is taken from OT_DATABASE_*. Empty
+        # means a single world
+        OT_WORLDS={},
+        OT_HOME_WORLD=None,
+        OT_WORLD_TIMEOUT=2,
+        # Threads per world for the queries that run against every world
+        OT_WORLD_WORKERS=4,
         OT_DATABASE_HOST="localhost",
         OT_DATABASE_USER="forgotten",
         OT_DATABASE_PASSWORD="forgotten",
         OT_DATABASE_NAME="forgotten",
+        # Each replica is a dict with any of host, user, password and name,
+        # the rest is taken from the primary
+        OT_DATABASE_REPLICAS=[],
+        OT_DATABASE_MAX_REPLICA_LAG=5,
+        OT_DATABASE_REPLICA_CHECK_INTERVAL=5,
+        OT_DATABASE_POOL_MIN_SIZE=0,
+        OT_DATABASE_POOL_MAX_SIZE=10,
+        OT_DATABASE_POOL_TIMEOUT=10,
+        OT_DATABASE_POOL_MAX_LIFETIME=3600,
+        OT_DATABASE_POOL_PING=True,
+        # Seconds a query may wait for the server, None waits forever. Keep
+        # it above the slowest command line job, like migrations
+        OT_DATABASE_READ_TIMEOUT=None,
+        # Use "scrypt" only with a game server that understands it, stock
+        # forgottenserver compares SHA-1 hashes itself
+        OT_PASSWORD_HASH="sha1",
+        OT_PASSWORD_SCRYPT_N=2**14,
+        OT_PASSWORD_SCRYPT_R=8,
+        OT_PASSWORD_SCRYPT_P=1,
+        OT_PASSWORD_EXECUTOR="thread",
+        OT_PASSWORD_WORKERS=2,
+        OT_PASSWORD_QUEUE_SIZE=16,
+        OT_PASSWORD_TIMEOUT=5,
+        # Token buckets for the login, register and account forms
+        OT_RATE_LIMIT=True,
+        OT_RATE_LIMIT_IP_BURST=20,
+        OT_RATE_LIMIT_IP_PER_MINUTE=10,
+        OT_RATE_LIMIT_ACCOUNT_BURST=5,
+        OT_RATE_LIMIT_ACCOUNT_PER_MINUTE=2,
+        # Number of reverse proxies, like nginx, in front of the app whose
+        # X-Forwarded-For and X-Forwarded-Proto are trusted. Without it,
+        # behind a proxy every visitor shares the proxy's address
+        OT_PROXY_COUNT=0,
+        OT_RATE_LIMIT_FILE=os.path.join(app.instance_path, "ratelimit.bin"),
+        OT_RATE_LIMIT_MAX_BUCKETS=65536,
+        # Persist compiled templates and compile them all in create_app
+        OT_FAST_START=False,
+        # Written by flask build-assets
+        OT_ASSETS_DIR=os.path.join(app.instance_path, "assets"),
+        # Written by flask freeze
+        OT_FREEZE_DIR=os.path.join(app.instance_path, "frozen"),
+        # Metrics related config
+        OT_METRICS_DIR=os.path.join(app.instance_path, "metrics"),
+        OT_METRICS_TOKEN=None,
+        OT_METRICS_ALLOWED_ADDRS=["127.0.0.1", "::1"],
+        OT_METRICS_FLUSH_INTERVAL=1,
         # Flask related config
         SECRET_KEY="dev",
         # Flask-Caching related config
-        CACHE_TYPE="FileSystemCache",
+        CACHE_TYPE="pCarrot.cache.TieredCache",
+        CACHE_SHARED_TYPE="FileSystemCache",
+        CACHE_LOCAL_THRESHOLD=1024,
+        CACHE_LOCAL_TIMEOUT=10,
         CACHE_DEFAULT_TIMEOUT=300,
-        CACHE_DIR=os.path.join(app.instance_path, "cache")
+        CACHE_GENERATION_CHECK_INTERVAL=1,
+        CACHE_DIR=os.path.join(app.instance_path, "cache"),
+        CACHE_DURABLE_DIR=os.path.join(app.instance_path, "cache-durable")
     )
 
     if test_config is None:
@@ -62,17 +160,72 @@ def create_app(test_config=None):
 
     os.makedirs(app.instance_path, exist_ok=True)
 
+    if app.config["OT_PROXY_COUNT"]:
+        from werkzeug.middleware.proxy_fix import ProxyFix
+        app.wsgi_app = ProxyFix(
+            app.wsgi_app,
+            x_for=app.config["OT_PROXY_COUNT"],
+            x_proto=app.config["OT_PROXY_COUNT"]
+        )
+
+    from . import metrics
+    metrics.init_app(app)
+
     from . import db
     db.init_app(app)
 
+    from . import migrate
+    migrate.init_app(app)
+
     from . import cache
     cache.init_app(app)
 
+    from . import worlds
+    worlds.init_app(app)
+
+    from . import news
+    news.init_app(app)
+
+    from . import highscores
+    highscores.init_app(app)
+
+    from . import guilds
+    guilds.init_app(app)
+
+    from . import status
+    status.init_app(app)
+
+    from . import assets
+    assets.init_app(app)
+
+    from . import deaths
+    deaths.init_app(app)
+
     from . import auth
+    from . import api
     from . import public
+    from . import characters
     from . import account
+    account.init_app(app)
     app.register_blueprint(auth.bp)
     app.register_blueprint(public.bp)
+    app.register_blueprint(news.bp)
     app.register_blueprint(account.bp)
+    app.register_blueprint(highscores.bp)
+    app.register_blueprint(characters.bp)
+    app.register_blueprint(guilds.bp)
+    app.register_blueprint(deaths.bp)
+    app.register_blueprint(api.bp)
+    app.register_blueprint(status.bp)
+    app.register_blueprint(metrics.bp)
+
+    from . import freeze
+    freeze.init_app(app)
+
+    from . import startup
+    startup.init_app(app, _import_time, time.perf_counter() - start)
+    app.extensions["pcarrot_startup"]["create_app"] = (
+        time.perf_counter() - start
+    )
 
     return app
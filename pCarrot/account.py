@@ -23,90 +23,153 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-import hashlib
+import csv
+import json
+import time
+import click
+import itertools
 
 from flask import g
+from flask import session
 from flask import Blueprint
 from flask import render_template
 
-from flask_wtf import FlaskForm
-
-from wtforms import SubmitField
-from wtforms import PasswordField
-
-from wtforms.validators import Length
-from wtforms.validators import EqualTo
-from wtforms.validators import DataRequired
-
+from .db import get_worlds
 from .auth import login_required
+from .worlds import fan_out
 
+from .model import import_accounts
+from .model import get_account_characters
+from .model import get_account_password
 from .model import change_account_password
 from .model import AccountChangePasswordError
 
-class ChangePasswordForm(FlaskForm):
-    current_password = PasswordField(
-        "Current password",
-        validators=[
-            DataRequired("You must enter your current password")
-        ],
-        render_kw={"placeholder": "Type your current password"}
-    )
-    new_password = PasswordField(
-        "New password",
-        validators=[
-            DataRequired("You must enter your new password"),
-            Length(
-                min=8,
-                max=32,
-                message="Your new password must be between 8 and 32 characters"
-                        " long"
-            )
-        ],
-        render_kw={"placeholder": "Type your new password"}
-    )
-    confirm_password = PasswordField(
-        "Confirm new password",
-        validators=[
-            DataRequired("You must confirm your new password"),
-            EqualTo("new_password", message="Your new password does not match")
-        ],
-        render_kw={"placeholder": "Confirm your new password"}
+from .passwords import hash_password
+from .passwords import verify_password
+from .passwords import PasswordServiceBusyError
+
+from .ratelimit import rate_limited
+
+def get_characters_in_worlds():
+    # Sessions from before worlds were introduced do not know the name
+    account_name = session.get("account_name")
+    if account_name is None:
+        return None, []
+    try:
+        results, failed = fan_out(get_account_characters, account_name)
+    except Exception:
+        return None, []
+    return [
+        (world, results[world]) for world in get_worlds() if world in results
+    ], failed
+
+def _render_index(form):
+    # Also after a failed password change, the characters are still listed
+    characters, failed = get_characters_in_worlds()
+    return render_template(
+        "account/index.html",
+        form=form,
+        characters=characters,
+        failed_worlds=failed
     )
-    submit = SubmitField("Submit")
 
 bp = Blueprint("account", __name__)
 
 @bp.route("/account", methods=("GET", "POST"))
 @login_required
+@rate_limited
 def index():
+    from .forms import ChangePasswordForm
     form = ChangePasswordForm()
     if form.validate_on_submit():
-        current_password = hashlib.sha1(
-            form.current_password.data.encode("utf-8")
-        ).hexdigest()
-        new_password = hashlib.sha1(
-            form.new_password.data.encode("utf-8")
-        ).hexdigest()
-
-        if current_password == new_password:
+        if form.current_password.data == form.new_password.data:
             form.new_password.errors.append(
                 "Your new password must be different from your current password"
             )
-            return render_template("account/index.html", form=form)
+            return _render_index(form)
 
         try:
+            current_password = get_account_password(g.account_id)
+            valid, _ = verify_password(
+                form.current_password.data,
+                current_password
+            )
+            if not valid:
+                raise AccountChangePasswordError("Invalid current password")
             change_account_password(
                 g.account_id,
                 current_password,
-                new_password
+                hash_password(form.new_password.data)
             )
         except AccountChangePasswordError as e:
             form.current_password.errors.append(e)
-            return render_template("account/index.html", form=form)
+            return _render_index(form)
+        except PasswordServiceBusyError as e:
+            form.form_errors.append(e)
+            return _render_index(form)
         except:
             form.form_errors.append("Oops! Something went wrong, try again")
-            return render_template("account/index.html", form=form)
+            return _render_index(form)
 
         return render_template("account/change_password_success.html")
 
-    return render_template("account/index.html", form=form)
+    return _render_index(form)
+
+def _read_accounts(file, file_format):
+    if file_format == "csv":
+        return csv.DictReader(file)
+    return (json.loads(line) for line in file if line.strip())
+
+@click.command("import-accounts", help="Import accounts from a CSV/JSONL file.")
+@click.argument("file", type=click.File("r", encoding="utf-8"))
+@click.option(
+    "--format",
+    "file_format",
+    type=click.Choice(["csv", "jsonl"]),
+    default="csv",
+    show_default=True,
+    help="Format of FILE, with name, password and optional email and creation."
+)
+@click.option(
+    "--batch-size",
+    default=1000,
+    show_default=True,
+    help="Number of accounts inserted per transaction."
+)
+@click.option(
+    "--hash-passwords",
+    is_flag=True,
+    help="Hash the passwords of FILE, which are in plain text."
+)
+def import_accounts_command(file, file_format, batch_size, hash_passwords):
+    now = int(time.time())
+    num_read = 0
+    num_imported = 0
+    accounts = _read_accounts(file, file_format)
+    try:
+        while True:
+            batch = []
+            for account in itertools.islice(accounts, batch_size):
+                password = account["password"]
+                if hash_passwords:
+                    password = hash_password(password)
+                batch.append((
+                    account["name"],
+                    password,
+                    account.get("email") or "",
+                    int(account.get("creation") or now)
+                ))
+            if not batch:
+                break
+            num_read += len(batch)
+            num_imported += import_accounts(batch)
+            click.echo(f"Imported {num_imported} of {num_read} accounts")
+    except Exception as e:
+        raise click.UsageError(message=e)
+    click.echo(
+        f"Imported {num_imported} accounts, skipped {num_read - num_imported}"
+        " whose name was already in use"
+    )
+
+def init_app(app):
+    app.cli.add_command(import_accounts_command)
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# MIT License
+#
+# Copyright (c) 2023 Iñaki Amatria-Barral
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import json
+import hashlib
+import datetime
+
+from flask import request
+from flask import Blueprint
+from flask import current_app
+from flask import make_response
+
+from .model import get_characters
+from .model import get_latest_news
+from .status import get_status
+
+bp = Blueprint("api", __name__, url_prefix="/api/v1")
+
+def _serialize(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+def _json_response(data, status=200):
+    body = json.dumps(
+        data,
+        default=_serialize,
+        ensure_ascii=False,
+        separators=(",", ":")
+    )
+    response = make_response(body, status)
+    response.mimetype = "application/json"
+    if status != 200:
+        return response
+    response.set_etag(hashlib.sha256(body.encode("utf-8")).hexdigest())
+    response.cache_control.public = True
+    response.cache_control.max_age = current_app.config["OT_API_MAX_AGE"]
+    return response.make_conditional(request)
+
+def _error(message, status):
+    return _json_response({"error": message}, status)
+
+@bp.route("/news")
+def news():
+    try:
+        latest_news = get_latest_news(current_app.config["OT_NUM_LATEST_NEWS"])
+    except:
+        return _error("News are not available", 503)
+    return _json_response({
+        "news": [
+            {
+                "id": n["id"],
+                "title": n["title"],
+                "body_html": n["body_html"],
+                "date": n["date"]
+            }
+            for n in latest_news
+        ]
+    })
+
+@bp.route("/status")
+def status():
+    server_status = get_status()
+    if server_status is None:
+        return _error("Server status is not available", 503)
+    return _json_response({
+        "online": server_status["online"],
+        "uptime": server_status.get("uptime"),
+        "players_online": server_status.get("players_online", 0),
+        "players_max": server_status.get("players_max", 0),
+        "players_peak": server_status.get("players_peak", 0),
+        "players": [
+            {"name": name, "level": level}
+            for name, level in server_status.get("players", [])
+        ],
+        "updated": server_status.get("updated")
+    })
+
+@bp.route("/characters")
+def characters():
+    # Accepts both ?name=a&name=b and ?name=a,b
+    names = {}
+    for value in request.args.getlist("name"):
+        for name in value.split(","):
+            name = name.strip()
+            if name:
+                names.setdefault(name.lower(), name)
+    if not names:
+        return _error("At least one name is required", 400)
+    max_names = current_app.config["OT_API_MAX_NAMES"]
+    if len(names) > max_names:
+        return _error(f"At most {max_names} names are allowed", 400)
+
+    try:
+        found = get_characters(tuple(sorted(names.values())))
+    except:
+        return _error("Characters are not available", 503)
+    for character in found:
+        names.pop(character["name"].lower(), None)
+    return _json_response({
+        "characters": [
+            dict(character, online=bool(character["online"]))
+            for character in found
+        ],
+        "missing": sorted(names.values())
+    })
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# MIT License
+#
+# Copyright (c) 2023 Iñaki Amatria-Barral
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import gzip
+import json
+import click
+import hashlib
+import mimetypes
+
+from flask import request
+from flask import current_app
+from flask import make_response
+
+MANIFEST = "manifest.json"
+
+# Already compressed formats gain nothing from another pass
+COMPRESSIBLE_TYPES = (
+    "text/",
+    "application/javascript",
+    "image/svg+xml",
+    "image/vnd.microsoft.icon",
+    "image/x-icon"
+)
+
+SUFFIXES = {"identity": "", "gzip": ".gz", "br": ".br"}
+
+def _hashed_name(filename, digest):
+    root, ext = os.path.splitext(filename)
+    return f"{root}.{digest[:12]}{ext}"
+
+def _compress(data):
+    variants = {"gzip": gzip.compress(data, compresslevel=9, mtime=0)}
+    try:
+        # Listed in requirements.txt, but gzip alone still covers every
+        # browser where it is missing
+        import brotli
+    except ImportError:
+        brotli = None
+    if brotli is not None:
+        variants["br"] = brotli.compress(data, quality=11)
+    return {
+        encoding: compressed for encoding, compressed in variants.items()
+        if len(compressed) < len(data)
+    }
+
+def build_assets(static_folder, output_dir, echo=None):
+    manifest = {}
+    for root, _, files in os.walk(static_folder):
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            filename = os.path.relpath(path, static_folder).replace(os.sep, "/")
+            with open(path, "rb") as f:
+                data = f.read()
+            digest = hashlib.sha256(data).hexdigest()
+            hashed = _hashed_name(filename, digest)
+            target = os.path.join(output_dir, hashed)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+
+            variants = {"identity": data}
+            mimetype = mimetypes.guess_type(filename)[0] or ""
+            if mimetype.startswith(COMPRESSIBLE_TYPES):
+                variants.update(_compress(data))
+            for encoding, content in variants.items():
+                with open(target + SUFFIXES[encoding], "wb") as f:
+                    f.write(content)
+            manifest[filename] = {
+                "name": hashed,
+                "etag": digest,
+                "encodings": sorted(variants)
+            }
+            if echo is not None:
+                echo(f"{filename} -> {hashed} ({', '.join(sorted(variants))})")
+
+    # The manifest goes last, pages only link the new files once they exist
+    tmp = os.path.join(output_dir, MANIFEST + ".tmp")
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp, os.path.join(output_dir, MANIFEST))
+    return manifest
+
+def load_assets(output_dir):
+    try:
+        with open(os.path.join(output_dir, MANIFEST)) as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return {}, {}
+
+    assets = {}
+    for filename, entry in manifest.items():
+        path = os.path.join(output_dir, entry["name"])
+        variants = {}
+        for encoding in entry["encodings"]:
+            with open(path + SUFFIXES[encoding], "rb") as f:
+                variants[encoding] = f.read()
+        assets[entry["name"]] = {
+            "etag": entry["etag"],
+            "mimetype": mimetypes.guess_type(filename)[0]
+            or "application/octet-stream",
+            "variants": variants
+        }
+    names = {filename: entry["name"] for filename, entry in manifest.items()}
+    return names, assets
+
+def _choose_encoding(variants):
+    accepted = request.accept_encodings
+    for encoding in ("br", "gzip"):
+        if encoding in variants and accepted[encoding]:
+            return encoding
+    return "identity"
+
+def send_asset(asset):
+    encoding = _choose_encoding(asset["variants"])
+    response = make_response(asset["variants"][encoding])
+    response.mimetype = asset["mimetype"]
+    if encoding != "identity":
+        response.content_encoding = encoding
+    response.vary.add("Accept-Encoding")
+    # A strong ETag names the exact bytes, each encoding needs its own
+    response.set_etag(asset["etag"] + SUFFIXES[encoding].replace(".", "-"))
+    # The name changes with the content, so it can be cached forever
+    response.cache_control.public = True
+    response.cache_control.max_age = 31536000
+    response.cache_control.immutable = True
+    return response.make_conditional(request)
+
+@click.command(
+    "build-assets",
+    help="Write content hashed and precompressed copies of the static files."
+)
+def build_assets_command():
+    build_assets(
+        current_app.static_folder,
+        current_app.config["OT_ASSETS_DIR"],
+        echo=click.echo
+    )
+    click.echo("Restart the workers to serve the new assets")
+
+def init_app(app):
+    app.cli.add_command(build_assets_command)
+    names, assets = load_assets(app.config["OT_ASSETS_DIR"])
+    if not names:
+        return
+
+    # url_for("static", ...) emits the hashed names, served from memory
+    @app.url_defaults
+    def hash_static_filename(endpoint, values):
+        if endpoint == "static":
+            filename = values.get("filename")
+            values["filename"] = names.get(filename, filename)
+
+    send_static_file = app.view_functions["static"]
+
+    def static(filename):
+        asset = assets.get(filename)
+        if asset is None:
+            return send_static_file(filename=filename)
+        return send_asset(asset)
+
+    app.view_functions["static"] = static
@@ -23,7 +23,7 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-import hashlib
+import logging
 import functools
 
 from flask import g
@@ -33,73 +33,20 @@ from flask import redirect
 from flask import Blueprint
 from flask import render_template
 
-from flask_wtf import FlaskForm
-
-from wtforms import StringField
-from wtforms import SubmitField
-from wtforms import PasswordField
-
-from wtforms.validators import Length
-from wtforms.validators import EqualTo
-from wtforms.validators import DataRequired
-
-from .model import get_account_id
+from .model import get_account
 from .model import AccountNotFoundError
 from .model import register_new_account
 from .model import AccountNameInUseError
+from .model import rehash_account_password
+
+from .passwords import hash_password
+from .passwords import verify_password
+from .passwords import verify_dummy_password
+from .passwords import PasswordServiceBusyError
+
+from .ratelimit import rate_limited
 
-class LoginForm(FlaskForm):
-    account_name = StringField(
-        "Account name",
-        validators=[
-            DataRequired("You must enter your account name")
-        ],
-        render_kw={"placeholder": "Type your account name"}
-    )
-    password = PasswordField(
-        "Password",
-        validators=[
-            DataRequired("You must enter your password")
-        ],
-        render_kw={"placeholder": "Type your password"}
-    )
-    submit = SubmitField("Submit")
-
-class RegisterForm(FlaskForm):
-    account_name = StringField(
-        "Account name",
-        validators=[
-            DataRequired("You must enter an account name"),
-            Length(
-                min=4,
-                max=16,
-                message="Your account account name must be between 4 and 16"
-                        " characters long"
-            )
-        ],
-        render_kw={"placeholder": "Type your account name"}
-    )
-    password = PasswordField(
-        "Password",
-        validators=[
-            DataRequired("You must enter a password"),
-            Length(
-                min=8,
-                max=32,
-                message="Your password must be between 8 and 32 characters long"
-            )
-        ],
-        render_kw={"placeholder": "Type your password"}
-    )
-    confirm_password = PasswordField(
-        "Confirm password",
-        validators=[
-            DataRequired("You must confirm your password"),
-            EqualTo("password", message="Your passwords do not match")
-        ],
-        render_kw={"placeholder": "Confirm your password"}
-    )
-    submit = SubmitField("Submit")
+logger = logging.getLogger(__name__)
 
 def login_required(view):
     @functools.wraps(view)
@@ -116,39 +63,75 @@ def load_logged_in_user():
     account_id = session.get("account_id")
     g.account_id = None if account_id is None else account_id
 
+def _check_password(account_name, password):
+    try:
+        account = get_account(account_name)
+    except AccountNotFoundError:
+        # Otherwise the response time would tell which account names exist
+        verify_dummy_password(password)
+        raise
+    valid, needs_rehash = verify_password(password, account["password"])
+    if not valid:
+        raise AccountNotFoundError("Invalid account name or password")
+    return account, needs_rehash
+
 @bp.route("/login", methods=("GET", "POST"))
+@rate_limited
 def login():
+    from .forms import LoginForm
     form = LoginForm()
     if form.validate_on_submit():
         account_name = form.account_name.data
-        password = hashlib.sha1(form.password.data.encode("utf-8")).hexdigest()
+        password = form.password.data
 
         try:
-            account_id = get_account_id(account_name, password)
+            account, needs_rehash = _check_password(account_name, password)
         except AccountNotFoundError as e:
             form.account_name.errors.append(e)
             form.password.errors.append(e)
             return render_template("auth/login.html", form=form)
+        except PasswordServiceBusyError as e:
+            form.form_errors.append(e)
+            return render_template("auth/login.html", form=form)
         except:
             form.form_errors.append("Oops! Something went wrong, try again")
             return render_template("auth/login.html", form=form)
+        account_id = account["id"]
+
+        if needs_rehash:
+            # Best effort, the account is migrated on a later login otherwise
+            try:
+                rehash_account_password(
+                    account_id,
+                    account["password"],
+                    hash_password(password)
+                )
+            except Exception:
+                logger.exception("Could not rehash account %s", account_id)
+
         session["account_id"] = account_id
+        session["account_name"] = account_name
 
         return redirect(url_for("account.index"))
     return render_template("auth/login.html", form=form)
 
 @bp.route("/register", methods=("GET", "POST"))
+@rate_limited
 def register():
+    from .forms import RegisterForm
     form = RegisterForm()
     if form.validate_on_submit():
         account_name = form.account_name.data
-        password = hashlib.sha1(form.password.data.encode("utf-8")).hexdigest()
 
         try:
+            password = hash_password(form.password.data)
             register_new_account(account_name, password)
         except AccountNameInUseError as e:
             form.account_name.errors.append(e)
             return render_template("auth/register.html", form=form)
+        except PasswordServiceBusyError as e:
+            form.form_errors.append(e)
+            return render_template("auth/register.html", form=form)
         except:
             form.form_errors.append("Oops! Something went wrong, try again")
             return render_template("auth/register.html", form=form)
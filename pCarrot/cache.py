@@ -23,9 +23,429 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-from flask_caching import Cache
+import os
+import time
+import click
+import logging
+import functools
+import threading
+import collections
+
+from flask import current_app
+
+from werkzeug.utils import import_string
+
+from flask_caching import Cache as BaseCacheExtension
+from flask_caching.backends.base import BaseCache
+from flask_caching.backends.filesystemcache import FileSystemCache
+
+from .db import get_world
+from .metrics import observe_memoize
+
+logger = logging.getLogger(__name__)
+
+_memoize_state = threading.local()
+
+# Bounded, in-process LRU cache with per-key expiration
+class LocalCache(BaseCache):
+    def __init__(self, threshold=1024, default_timeout=30):
+        super().__init__(default_timeout=default_timeout)
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._items = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _expires(self, timeout):
+        timeout = self._normalize_timeout(timeout)
+        if self.default_timeout:
+            timeout = min(timeout or self.default_timeout, self.default_timeout)
+        return time.monotonic() + timeout if timeout else None
+
+    def _lookup(self, key, now):
+        item = self._items.get(key)
+        if item is None:
+            return None
+        if item[1] is not None and item[1] <= now:
+            del self._items[key]
+            return None
+        self._items.move_to_end(key)
+        return item
+
+    def get(self, key):
+        with self._lock:
+            item = self._lookup(key, time.monotonic())
+            if item is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return item[0]
+
+    def has(self, key):
+        with self._lock:
+            return self._lookup(key, time.monotonic()) is not None
+
+    def set(self, key, value, timeout=None):
+        expires = self._expires(timeout)
+        with self._lock:
+            self._items[key] = (value, expires)
+            self._items.move_to_end(key)
+            while self.threshold and len(self._items) > self.threshold:
+                self._items.popitem(last=False)
+                self.evictions += 1
+        return True
+
+    def add(self, key, value, timeout=None):
+        with self._lock:
+            if self._lookup(key, time.monotonic()) is not None:
+                return False
+        return self.set(key, value, timeout)
+
+    def delete(self, key):
+        with self._lock:
+            return self._items.pop(key, None) is not None
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+        return True
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._items),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
+
+# Per-worker LocalCache in front of the cache shared by every worker
+class TieredCache(BaseCache):
+    def __init__(self, local, shared, durable=None, default_timeout=300):
+        super().__init__(default_timeout=default_timeout)
+        self.local = local
+        self.shared = shared
+        self.durable = shared if durable is None else durable
+        self.shared_hits = 0
+        self.shared_misses = 0
+        self.shared_evictions = 0
+        # Only backends that count their entries, like FileSystemCache, can
+        # tell how many of them were evicted
+        prune = getattr(shared, "_prune", None)
+        if prune is not None and hasattr(shared, "_file_count"):
+            shared._prune = functools.partial(self._counting_prune, prune)
+
+    @classmethod
+    def factory(cls, app, config, args, kwargs):
+        shared_type = config["CACHE_SHARED_TYPE"]
+        if "." not in shared_type:
+            shared_type = "flask_caching.backends." + shared_type
+        shared_factory = import_string(shared_type)
+        if isinstance(shared_factory, type) and issubclass(
+            shared_factory, BaseCache
+        ):
+            shared_factory = shared_factory.factory
+        shared = shared_factory(app, config, args, dict(kwargs))
+        local = LocalCache(
+            threshold=config["CACHE_LOCAL_THRESHOLD"],
+            default_timeout=config["CACHE_LOCAL_TIMEOUT"]
+        )
+        # FileSystemCache prunes the entries closest to expiry first, and
+        # entries without a timeout count as expiring at 0, so the few that
+        # must never be pruned get a directory without a threshold
+        durable = None
+        if isinstance(shared, FileSystemCache):
+            durable = FileSystemCache(
+                config["CACHE_DURABLE_DIR"],
+                threshold=0,
+                default_timeout=0
+            )
+        return cls(
+            local,
+            shared,
+            durable,
+            default_timeout=kwargs["default_timeout"]
+        )
+
+    def _counting_prune(self, prune):
+        before = self.shared._file_count
+        prune()
+        self.shared_evictions += max(before - self.shared._file_count, 0)
+
+    def get(self, key):
+        value = self.local.get(key)
+        if value is not None:
+            return value
+        value = self.shared.get(key)
+        if value is None:
+            self.shared_misses += 1
+            return None
+        self.shared_hits += 1
+        self.local.set(key, value)
+        return value
+
+    def get_many(self, *keys):
+        return [self.get(key) for key in keys]
+
+    def has(self, key):
+        return self.local.has(key) or self.shared.has(key)
+
+    def set(self, key, value, timeout=None):
+        self.local.set(key, value, timeout)
+        return self.shared.set(key, value, timeout)
+
+    def set_many(self, mapping, timeout=None):
+        return [
+            key for key, value in mapping.items()
+            if self.set(key, value, timeout)
+        ]
+
+    def add(self, key, value, timeout=None):
+        # The shared tier decides, otherwise every worker would win the race
+        added = self.shared.add(key, value, timeout)
+        if added:
+            self.local.set(key, value, timeout)
+        return added
+
+    def delete(self, key):
+        self.local.delete(key)
+        return self.shared.delete(key)
+
+    def delete_many(self, *keys):
+        return [key for key in keys if self.delete(key)]
+
+    def clear(self):
+        self.local.clear()
+        return self.shared.clear()
+
+    def stats(self):
+        return {
+            "local": self.local.stats(),
+            "shared": {
+                "hits": self.shared_hits,
+                "misses": self.shared_misses,
+                "evictions": self.shared_evictions
+            }
+        }
+
+class Cache(BaseCacheExtension):
+    _num_flight_locks = 64
+    _retry_timeout = 10
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._flight_locks = [
+            threading.Lock() for _ in range(self._num_flight_locks)
+        ]
+        self._generations = {}
+        self._durable_reads = {}
+
+    # Entries that must outlive everything else, like generation tokens and
+    # the status snapshot, live in the durable store of the backend
+    @property
+    def durable(self):
+        return getattr(self.cache, "durable", self.cache)
+
+    # Durable entries are shared by every worker but rarely change, each
+    # worker reads one at most every max_age seconds
+    def get_durable(self, key, max_age):
+        now = time.monotonic()
+        known = self._durable_reads.get(key)
+        if known is not None and now - known[1] < max_age:
+            return known[0]
+        value = self.durable.get(key)
+        self._durable_reads[key] = (value, now)
+        return value
+
+    # Every namespace has a generation token in the durable store that is
+    # part of the key of everything memoized under it. Bumping the token
+    # makes every worker miss at once, no matter what its local tier holds
+    def get_generation(self, namespace):
+        interval = current_app.config["CACHE_GENERATION_CHECK_INTERVAL"]
+        now = time.monotonic()
+        known = self._generations.get(namespace)
+        if known is not None and interval and now - known[1] < interval:
+            return known[0]
+
+        key = f"pcarrot.generation.{namespace}"
+        durable = self.durable
+        generation = durable.get(key)
+        if generation is None:
+            generation = f"{time.time_ns():x}"
+            if not durable.add(key, generation, timeout=0):
+                generation = durable.get(key) or generation
+        self._generations[namespace] = (generation, now)
+        return generation
+
+    def invalidate(self, *namespaces):
+        for namespace in namespaces:
+            generation = f"{time.time_ns():x}"
+            self.durable.set(
+                f"pcarrot.generation.{namespace}",
+                generation,
+                timeout=0
+            )
+            self._generations.pop(namespace, None)
+
+    # A lease held by one caller across every worker. cachelib's add() only
+    # checks whether FileSystemCache has a file for the key, not whether it
+    # expired, so the deadline is kept in the value and checked here. Read
+    # after write: of two callers racing for an expired lease, the one that
+    # wrote last gets it
+    def acquire_lease(self, key, owner, timeout, store=None):
+        store = store or getattr(self.cache, "shared", self.cache)
+        now = time.time()
+        lease = store.get(key)
+        if lease is not None and lease[0] != owner and lease[1] > now:
+            return False
+        store.set(key, (owner, now + timeout), timeout=timeout)
+        lease = store.get(key)
+        return lease is not None and lease[0] == owner
+
+    def release_lease(self, key, owner, store=None):
+        store = store or getattr(self.cache, "shared", self.cache)
+        lease = store.get(key)
+        if lease is not None and lease[0] == owner:
+            store.delete(key)
+
+    def _flight_lock(self, key):
+        return self._flight_locks[hash(key) % self._num_flight_locks]
+
+    def _refresh(self, f, key, fresh_timeout, stale_timeout, args, kwargs):
+        value = f(*args, **kwargs)
+        self.set(
+            key,
+            (value, time.time() + fresh_timeout),
+            timeout=fresh_timeout + stale_timeout
+        )
+        return value
+
+    # Expired values are kept for stale_timeout extra seconds: a single
+    # caller recomputes them while the rest, or everybody if recomputing
+    # fails, keep getting the stale value
+    def _memoize_stale(self, f, timeout, stale_timeout, kwargs):
+        memoized = super().memoize(timeout=timeout, **kwargs)(f)
+
+        @functools.wraps(f)
+        def decorated_function(*args, **kwargs):
+            fresh_timeout = timeout
+            if fresh_timeout is None:
+                fresh_timeout = current_app.config["CACHE_DEFAULT_TIMEOUT"]
+            refresh = functools.partial(
+                self._refresh, f, fresh_timeout=fresh_timeout,
+                stale_timeout=stale_timeout, args=args, kwargs=kwargs
+            )
+
+            try:
+                key = memoized.make_cache_key(f, *args, **kwargs)
+                entry = self.get(key)
+            except Exception:
+                logger.exception("Exception possibly due to cache backend.")
+                return f(*args, **kwargs)
+            if entry is not None and entry[1] > time.time():
+                return entry[0]
+
+            refresh_key = f"{key}.refresh"
+            if entry is not None:
+                owner = os.urandom(8).hex()
+                if not self.acquire_lease(refresh_key, owner, fresh_timeout):
+                    return entry[0]
+                try:
+                    value = refresh(key=key)
+                except Exception:
+                    # Hold the refresh back for a while instead of having
+                    # every request retry against a failing database
+                    logger.exception("Serving stale value for %s", key)
+                    self.acquire_lease(
+                        refresh_key,
+                        owner,
+                        min(fresh_timeout, self._retry_timeout)
+                    )
+                    return entry[0]
+                self.release_lease(refresh_key, owner)
+                return value
+
+            with self._flight_lock(key):
+                entry = self.get(key)
+                if entry is not None:
+                    return entry[0]
+                return refresh(key=key)
+
+        decorated_function.make_cache_key = memoized.make_cache_key
+        return decorated_function
+
+    def memoize(self, timeout=None, stale_timeout=None, namespace=None,
+                per_world=True, **kwargs):
+        # Every world has its own database, so by default the same call
+        # is cached once per world
+        if namespace is not None or per_world:
+            make_name = kwargs.pop("make_name", None) or (lambda name: name)
+            kwargs["make_name"] = lambda name: "".join((
+                make_name(name),
+                f":{get_world()}" if per_world else "",
+                f"@{self.get_generation(namespace)}" if namespace else ""
+            ))
+
+        def decorator(f):
+            name = f"{f.__module__}.{f.__qualname__}"
+
+            # Only misses reach f, which is how hits and misses are told apart
+            @functools.wraps(f)
+            def compute(*args, **kwargs):
+                _memoize_state.missed = True
+                return f(*args, **kwargs)
+
+            if stale_timeout is None:
+                memoized = super(Cache, self).memoize(
+                    timeout=timeout,
+                    **kwargs
+                )(compute)
+            else:
+                memoized = self._memoize_stale(
+                    compute,
+                    timeout,
+                    stale_timeout,
+                    kwargs
+                )
+
+            @functools.wraps(f)
+            def decorated_function(*args, **kwargs):
+                missed = getattr(_memoize_state, "missed", False)
+                _memoize_state.missed = False
+                try:
+                    return memoized(*args, **kwargs)
+                finally:
+                    observe_memoize(name, not _memoize_state.missed)
+                    _memoize_state.missed = missed
+
+            decorated_function.uncached = f
+            decorated_function.cache_timeout = timeout
+            decorated_function.make_cache_key = memoized.make_cache_key
+            decorated_function.delete_memoized = (
+                lambda: self.delete_memoized(decorated_function)
+            )
+            return decorated_function
+
+        return decorator
 
 cache = Cache()
 
+def get_cache_stats():
+    backend = cache.cache
+    if hasattr(backend, "stats"):
+        return backend.stats()
+    return {}
+
+@click.command(
+    "invalidate-cache",
+    help="Make every worker drop what it cached under NAMESPACES."
+)
+@click.argument("namespaces", nargs=-1, required=True)
+def invalidate_cache_command(namespaces):
+    cache.invalidate(*namespaces)
+    click.echo(f"Invalidated {', '.join(namespaces)}")
+
 def init_app(app):
     cache.init_app(app)
+    app.cli.add_command(invalidate_cache_command)
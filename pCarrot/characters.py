@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# MIT License
+#
+# Copyright (c) 2023 Iñaki Amatria-Barral
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import time
+import datetime
+
+from flask import abort
+from flask import jsonify
+from flask import request
+from flask import url_for
+from flask import redirect
+from flask import Blueprint
+from flask import current_app
+from flask import render_template
+
+from .model import get_character
+from .model import search_characters
+
+bp = Blueprint("characters", __name__)
+
+@bp.app_template_filter("datetime")
+def format_timestamp(timestamp):
+    # The game server stores UNIX timestamps
+    return datetime.datetime.fromtimestamp(timestamp).strftime(
+        "%d/%m/%Y %H:%M"
+    )
+
+def _search(prefix):
+    if len(prefix) < current_app.config["OT_CHARACTER_SEARCH_MIN_LENGTH"]:
+        return []
+    return search_characters(
+        prefix,
+        current_app.config["OT_CHARACTER_SEARCH_LIMIT"]
+    )
+
+@bp.route("/characters")
+def index():
+    name = request.args.get("name", "").strip()
+    if not name:
+        return render_template("characters/index.html")
+    try:
+        characters = _search(name)
+    except:
+        return render_template("characters/index.html", name=name, error=True)
+    exact = [c for c in characters if c["name"].lower() == name.lower()]
+    if exact or len(characters) == 1:
+        match = (exact or characters)[0]["name"]
+        return redirect(url_for("characters.character", name=match))
+    return render_template(
+        "characters/index.html",
+        name=name,
+        characters=characters
+    )
+
+@bp.route("/characters/search")
+def search():
+    try:
+        characters = _search(request.args.get("q", "").strip())
+    except:
+        abort(503)
+    return jsonify([c["name"] for c in characters])
+
+@bp.route("/character/<name>")
+def character(name):
+    # Rounded to the day so every request of the day shares the cache entry
+    today = int(time.time()) // 86400 * 86400
+    days = current_app.config["OT_CHARACTER_DEATHS_DAYS"]
+    deaths_since = today - days * 86400
+    try:
+        character = get_character(name, deaths_since)
+    except:
+        return render_template(
+            "characters/character.html",
+            name=name,
+            error=True
+        )
+    if character is None:
+        abort(404)
+    return render_template("characters/character.html", character=character)
@@ -23,41 +23,235 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import os
+import time
 import click
+import random
+import functools
+import threading
 
 from flask import g
+from flask import session
 from flask import current_app
+from flask import has_request_context
 
 from pymysql import connect
+from pymysql.err import OperationalError
+from pymysql.err import ProgrammingError
 from pymysql.cursors import DictCursor
 
-def get_db():
-    if "db" not in g:
-        g.db = connect(
-            host=current_app.config["OT_DATABASE_HOST"],
-            user=current_app.config["OT_DATABASE_USER"],
-            password=current_app.config["OT_DATABASE_PASSWORD"],
-            db=current_app.config["OT_DATABASE_NAME"],
-            cursorclass=DictCursor
+from .pool import ConnectionPool
+from .metrics import observe_query
+
+_pool_lock = threading.Lock()
+
+class InstrumentedCursor(DictCursor):
+    def execute(self, query, args=None):
+        # executemany runs its batches through execute, they are timed there
+        if getattr(self, "_in_executemany", False):
+            return super().execute(query, args)
+        start = time.perf_counter()
+        try:
+            return super().execute(query, args)
+        finally:
+            observe_query(query, time.perf_counter() - start)
+
+    def executemany(self, query, args):
+        start = time.perf_counter()
+        self._in_executemany = True
+        try:
+            return super().executemany(query, args)
+        finally:
+            self._in_executemany = False
+            observe_query(query, time.perf_counter() - start)
+
+def _create_pool(config, target=None):
+    target = target or {}
+    return ConnectionPool(
+        functools.partial(
+            connect,
+            host=target.get("host", config["OT_DATABASE_HOST"]),
+            user=target.get("user", config["OT_DATABASE_USER"]),
+            password=target.get("password", config["OT_DATABASE_PASSWORD"]),
+            db=target.get("name", config["OT_DATABASE_NAME"]),
+            # A world that does not answer must not hold threads forever
+            connect_timeout=target.get("timeout", config["OT_WORLD_TIMEOUT"]),
+            read_timeout=target.get(
+                "read_timeout",
+                config["OT_DATABASE_READ_TIMEOUT"]
+            ),
+            cursorclass=InstrumentedCursor
+        ),
+        min_size=config["OT_DATABASE_POOL_MIN_SIZE"],
+        max_size=config["OT_DATABASE_POOL_MAX_SIZE"],
+        timeout=config["OT_DATABASE_POOL_TIMEOUT"],
+        max_lifetime=config["OT_DATABASE_POOL_MAX_LIFETIME"],
+        ping=config["OT_DATABASE_POOL_PING"]
+    )
+
+def _get_per_process(key, create):
+    # Pools are per process: connections must never be shared with the
+    # children of a preforking server
+    app = current_app._get_current_object()
+    entry = app.extensions.get(key)
+    if entry is None or entry[0] != os.getpid():
+        with _pool_lock:
+            entry = app.extensions.get(key)
+            if entry is None or entry[0] != os.getpid():
+                entry = (os.getpid(), create(app.config))
+                app.extensions[key] = entry
+    return entry[1]
+
+# Without OT_WORLDS the OT_DATABASE_* target is the only world
+DEFAULT_WORLD = "default"
+
+def get_worlds():
+    return list(current_app.config["OT_WORLDS"]) or [DEFAULT_WORLD]
+
+def get_home_world():
+    # The home world holds what is not tied to a world: news and accounts
+    return current_app.config["OT_HOME_WORLD"] or get_worlds()[0]
+
+def get_world():
+    return g.get("world") or get_home_world()
+
+def get_world_target(world):
+    config = current_app.config
+    if not config["OT_WORLDS"]:
+        return {"replicas": config["OT_DATABASE_REPLICAS"]}
+    return config["OT_WORLDS"][world]
+
+def get_pool(world=None):
+    world = world or get_world()
+    return _get_per_process(
+        f"pcarrot_pool.{world}",
+        lambda config: _create_pool(config, get_world_target(world))
+    )
+
+def get_pool_stats(world=None):
+    return get_pool(world).stats()
+
+class Replica:
+    def __init__(self, pool):
+        self.pool = pool
+        self.lock = threading.Lock()
+        self.usable = False
+        self.checked_at = None
+
+    def check(self, max_lag):
+        conn = self.pool.acquire()
+        try:
+            with conn.cursor() as cursor:
+                try:
+                    cursor.execute("SHOW REPLICA STATUS")
+                except (OperationalError, ProgrammingError):
+                    cursor.execute("SHOW SLAVE STATUS")
+                status = cursor.fetchone()
+        finally:
+            self.pool.release(conn)
+        if status is None:
+            return False
+        lag = status.get(
+            "Seconds_Behind_Source",
+            status.get("Seconds_Behind_Master")
         )
-    return g.db
+        # A NULL lag means replication is stopped or broken
+        return lag is not None and lag <= max_lag
+
+    def is_usable(self, config):
+        now = time.monotonic()
+        interval = config["OT_DATABASE_REPLICA_CHECK_INTERVAL"]
+        if self.checked_at is not None and now - self.checked_at < interval:
+            return self.usable
+        # One thread checks, the others go with the last known state
+        if not self.lock.acquire(blocking=False):
+            return self.usable
+        try:
+            self.usable = self.check(config["OT_DATABASE_MAX_REPLICA_LAG"])
+        except Exception:
+            self.usable = False
+        finally:
+            self.checked_at = now
+            self.lock.release()
+        return self.usable
+
+def get_replicas(world=None):
+    world = world or get_world()
+    target = get_world_target(world)
+    return _get_per_process(
+        f"pcarrot_replicas.{world}",
+        lambda config: [
+            Replica(_create_pool(config, {**target, **replica}))
+            for replica in target.get("replicas", [])
+        ]
+    )
+
+def _get_primary_db(world):
+    dbs = g.setdefault("dbs", {})
+    if world not in dbs:
+        dbs[world] = get_pool(world).acquire()
+    return dbs[world]
+
+def _reads_from_primary():
+    if g.get("db_wrote"):
+        return True
+    if not has_request_context():
+        return False
+    return session.get("db_primary_until", 0) > time.time()
+
+def get_db(world=None):
+    # The primary is the write handle: whoever asks for it is about to write
+    world = world or get_world()
+    g.setdefault("db_wrote", set()).add(world)
+    return _get_primary_db(world)
+
+def get_read_db(world=None):
+    world = world or get_world()
+    read_dbs = g.setdefault("read_dbs", {})
+    if world in read_dbs:
+        return read_dbs[world][1]
+    replicas = get_replicas(world)
+    if not replicas or _reads_from_primary():
+        return _get_primary_db(world)
+
+    config = current_app.config
+    start = random.randrange(len(replicas))
+    for replica in replicas[start:] + replicas[:start]:
+        if not replica.is_usable(config):
+            continue
+        try:
+            read_dbs[world] = (replica.pool, replica.pool.acquire())
+        except Exception:
+            replica.usable = False
+            continue
+        return read_dbs[world][1]
+    return _get_primary_db(world)
 
 def close_db(e=None):
-    db = g.pop("db", None)
-    if db is not None:
-        db.close()
+    for world, db in g.pop("dbs", {}).items():
+        get_pool(world).release(db)
+    for pool, read_db in g.pop("read_dbs", {}).values():
+        pool.release(read_db)
+
+def remember_write(response):
+    # Read your writes: after writing, the user keeps reading from the
+    # primary until the replicas have surely caught up
+    config = current_app.config
+    wrote = g.get("db_wrote", ())
+    if any(get_world_target(world).get("replicas") for world in wrote):
+        session["db_primary_until"] = int(
+            time.time() + config["OT_DATABASE_MAX_REPLICA_LAG"]
+            + config["OT_DATABASE_REPLICA_CHECK_INTERVAL"]
+        )
+    return response
 
 def init_db():
-    db = get_db()
-    with current_app.open_resource("schema.sql") as f:
-        lines = f.read().decode("utf-8").split(";")
-        for line in lines:
-            line = line.strip()
-            if line:
-                db.cursor().execute(line)
-    db.commit()
-
-@click.command("init-db", help="Initialize the database.")
+    from .migrate import upgrade
+    for world in get_worlds():
+        g.world = world
+        upgrade()
+
+@click.command("init-db", help="Initialize or upgrade the database.")
 def init_db_command():
     try:
         init_db()
@@ -67,5 +261,6 @@ def init_db_command():
         click.echo("Initialized the database")
 
 def init_app(app):
+    app.after_request(remember_write)
     app.teardown_appcontext(close_db)
     app.cli.add_command(init_db_command)
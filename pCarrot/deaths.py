@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# MIT License
+#
+# Copyright (c) 2023 Iñaki Amatria-Barral
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import json
+import time
+import logging
+import threading
+import collections
+
+from flask import g
+from flask import request
+from flask import Response
+from flask import Blueprint
+from flask import current_app
+from flask import render_template
+
+from .db import get_world
+from .model import get_deaths_after
+from .model import get_latest_deaths
+
+logger = logging.getLogger(__name__)
+
+_feeds_lock = threading.Lock()
+
+def _format_event(death):
+    # Serialized once here instead of once per subscriber
+    return (
+        f"id: {death['time']}-{death['player_id']}\n"
+        f"event: death\n"
+        f"data: {json.dumps(death, separators=(',', ':'))}\n\n"
+    )
+
+def _parse_event_id(event_id):
+    try:
+        death_time, player_id = event_id.split("-")
+        return int(death_time), int(player_id)
+    except (AttributeError, ValueError):
+        return None
+
+class DeathFeed:
+    def __init__(self, app, world):
+        self.app = app
+        self.world = world
+        self.pid = None
+        self.thread = None
+        self.lock = threading.Lock()
+        self.condition = threading.Condition()
+        self.events = collections.deque()
+        self.watermark = None
+
+    def start(self):
+        # Threads do not survive a fork, every worker needs its own poller
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            self.condition = threading.Condition()
+            self.events = collections.deque(
+                maxlen=self.app.config["OT_DEATHS_BUFFER_SIZE"]
+            )
+            self.watermark = None
+            self.thread = threading.Thread(
+                target=self._run,
+                name=f"pcarrot-deaths-{self.world}",
+                daemon=True
+            )
+            self.thread.start()
+
+    def _fetch(self):
+        limit = self.events.maxlen
+        with self.app.app_context():
+            g.world = self.world
+            if self.watermark is None:
+                return get_latest_deaths(limit)
+            deaths = get_deaths_after(*self.watermark, limit)
+            if len(deaths) == limit:
+                # More deaths than the buffer holds since the last poll,
+                # only the newest ones would survive anyway
+                deaths = get_latest_deaths(limit)
+            return deaths
+
+    def _poll(self):
+        deaths = self._fetch()
+        if self.watermark is None and not deaths:
+            self.watermark = (0, 0)
+        if not deaths:
+            return
+        with self.condition:
+            for death in deaths:
+                key = (death["time"], death["player_id"])
+                self.events.append((key, _format_event(death)))
+            self.watermark = self.events[-1][0]
+            self.condition.notify_all()
+
+    def _run(self):
+        interval = self.app.config["OT_DEATHS_INTERVAL"]
+        while True:
+            try:
+                self._poll()
+            except Exception:
+                logger.exception(
+                    "Unexpected error in the deaths poller of %s",
+                    self.world
+                )
+            time.sleep(interval)
+
+    def _events_after(self, key):
+        if key is None:
+            return [event for _, event in self.events]
+        events = []
+        for event_key, event in reversed(self.events):
+            if event_key <= key:
+                break
+            events.append(event)
+        events.reverse()
+        return events
+
+    def subscribe(self, last_event_id=None):
+        key = _parse_event_id(last_event_id)
+        keepalive = self.app.config["OT_DEATHS_KEEPALIVE"]
+        yield "retry: 5000\n\n"
+        while True:
+            # Subscribers only ever read the buffer, reconnecting with a
+            # Last-Event-ID costs no query
+            with self.condition:
+                events = self._events_after(key)
+                if not events:
+                    self.condition.wait(keepalive)
+                    events = self._events_after(key)
+                if events:
+                    key = self.events[-1][0]
+            if not events:
+                yield ": keepalive\n\n"
+                continue
+            yield "".join(events)
+
+def get_feed(world):
+    # One feed per world, created when its first viewer shows up
+    feeds = current_app.extensions["pcarrot_deaths"]
+    if world not in feeds:
+        with _feeds_lock:
+            if world not in feeds:
+                app = current_app._get_current_object()
+                feeds[world] = DeathFeed(app, world)
+    return feeds[world]
+
+bp = Blueprint("deaths", __name__)
+
+@bp.route("/deaths")
+def index():
+    return render_template("deaths/index.html")
+
+@bp.route("/deaths/stream")
+def stream():
+    feed = get_feed(get_world())
+    if feed.pid != os.getpid():
+        feed.start()
+    return Response(
+        feed.subscribe(request.headers.get("Last-Event-ID")),
+        mimetype="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"
+        }
+    )
+
+def init_app(app):
+    app.extensions["pcarrot_deaths"] = {}
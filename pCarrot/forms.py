@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# MIT License
+#
+# Copyright (c) 2023 Iñaki Amatria-Barral
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Imported by the views on first use, WTForms is not needed to start a worker
+
+from flask_wtf import FlaskForm
+
+from wtforms import StringField
+from wtforms import SubmitField
+from wtforms import PasswordField
+
+from wtforms.validators import Length
+from wtforms.validators import EqualTo
+from wtforms.validators import DataRequired
+
+class LoginForm(FlaskForm):
+    account_name = StringField(
+        "Account name",
+        validators=[
+            DataRequired("You must enter your account name")
+        ],
+        render_kw={"placeholder": "Type your account name"}
+    )
+    password = PasswordField(
+        "Password",
+        validators=[
+            DataRequired("You must enter your password")
+        ],
+        render_kw={"placeholder": "Type your password"}
+    )
+    submit = SubmitField("Submit")
+
+class RegisterForm(FlaskForm):
+    account_name = StringField(
+        "Account name",
+        validators=[
+            DataRequired("You must enter an account name"),
+            Length(
+                min=4,
+                max=16,
+                message="Your account account name must be between 4 and 16"
+                        " characters long"
+            )
+        ],
+        render_kw={"placeholder": "Type your account name"}
+    )
+    password = PasswordField(
+        "Password",
+        validators=[
+            DataRequired("You must enter a password"),
+            Length(
+                min=8,
+                max=32,
+                message="Your password must be between 8 and 32 characters long"
+            )
+        ],
+        render_kw={"placeholder": "Type your password"}
+    )
+    confirm_password = PasswordField(
+        "Confirm password",
+        validators=[
+            DataRequired("You must confirm your password"),
+            EqualTo("password", message="Your passwords do not match")
+        ],
+        render_kw={"placeholder": "Confirm your password"}
+    )
+    submit = SubmitField("Submit")
+
+class ChangePasswordForm(FlaskForm):
+    current_password = PasswordField(
+        "Current password",
+        validators=[
+            DataRequired("You must enter your current password")
+        ],
+        render_kw={"placeholder": "Type your current password"}
+    )
+    new_password = PasswordField(
+        "New password",
+        validators=[
+            DataRequired("You must enter your new password"),
+            Length(
+                min=8,
+                max=32,
+                message="Your new password must be between 8 and 32 characters"
+                        " long"
+            )
+        ],
+        render_kw={"placeholder": "Type your new password"}
+    )
+    confirm_password = PasswordField(
+        "Confirm new password",
+        validators=[
+            DataRequired("You must confirm your new password"),
+            EqualTo("new_password", message="Your new password does not match")
+        ],
+        render_kw={"placeholder": "Confirm your new password"}
+    )
+    submit = SubmitField("Submit")
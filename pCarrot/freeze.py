@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# MIT License
+#
+# Copyright (c) 2023 Iñaki Amatria-Barral
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import json
+import time
+import click
+import hashlib
+import tempfile
+
+from flask import url_for
+from flask import current_app
+from flask import template_rendered
+
+MANIFEST = ".freeze.json"
+
+def register_pages(app, pages):
+    # pages is called in a request context and returns the URLs to freeze,
+    # only plain paths: a static file cannot depend on the query string
+    app.extensions.setdefault("pcarrot_freeze", []).append(pages)
+
+def get_page_urls(app):
+    urls = []
+    with app.test_request_context():
+        for pages in app.extensions.get("pcarrot_freeze", []):
+            urls.extend(url for url in pages() if url not in urls)
+    return urls
+
+def get_page_path(url):
+    path = url.strip("/")
+    return os.path.join(path, "index.html") if path else "index.html"
+
+def _write_atomically(path, data):
+    # Written next to the target and renamed over it, nginx sees either the
+    # old page or the new one
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=".freeze-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+def _load_manifest(output_dir):
+    try:
+        with open(os.path.join(output_dir, MANIFEST)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+def freeze(app, output_dir, force=False, echo=None):
+    echo = echo or (lambda message: None)
+    manifest = _load_manifest(output_dir)
+    frozen = {}
+    stats = {"written": 0, "unchanged": 0, "failed": 0, "removed": 0}
+
+    # Views render their error template with a 200, it must not replace a
+    # good page
+    errors = []
+    def record_error(sender, template, context, **extra):
+        if context.get("error"):
+            errors.append(template.name)
+
+    client = app.test_client()
+    with template_rendered.connected_to(record_error, app):
+        for url in get_page_urls(app):
+            del errors[:]
+            response = client.get(url)
+            if response.status_code == 404:
+                continue
+            if response.status_code != 200 or errors:
+                echo(f"{url}: failed ({response.status_code}), kept")
+                stats["failed"] += 1
+                if url in manifest:
+                    frozen[url] = manifest[url]
+                continue
+            body = response.get_data()
+            digest = hashlib.sha256(body).hexdigest()
+            frozen[url] = digest
+            path = os.path.join(output_dir, get_page_path(url))
+            unchanged = manifest.get(url) == digest and os.path.exists(path)
+            if unchanged and not force:
+                stats["unchanged"] += 1
+                continue
+            _write_atomically(path, body)
+            stats["written"] += 1
+            echo(f"{url}: written")
+
+    for url in manifest:
+        if url not in frozen:
+            try:
+                os.unlink(os.path.join(output_dir, get_page_path(url)))
+            except FileNotFoundError:
+                pass
+            stats["removed"] += 1
+            echo(f"{url}: removed")
+
+    _write_atomically(
+        os.path.join(output_dir, MANIFEST),
+        json.dumps(frozen, indent=2, sort_keys=True).encode("utf-8")
+    )
+    return stats
+
+@click.command(
+    "freeze",
+    help="Render the public pages to static HTML for the reverse proxy."
+)
+@click.option(
+    "--output",
+    default=None,
+    help="Output directory. Defaults to OT_FREEZE_DIR."
+)
+@click.option(
+    "--force",
+    is_flag=True,
+    help="Rewrite every page, even if its content did not change."
+)
+@click.option(
+    "--interval",
+    type=int,
+    default=None,
+    help="Keep running and freeze again every INTERVAL seconds."
+)
+def freeze_command(output, force, interval):
+    app = current_app._get_current_object()
+    output = output or app.config["OT_FREEZE_DIR"]
+    while True:
+        start = time.perf_counter()
+        stats = freeze(app, output, force=force, echo=click.echo)
+        click.echo(
+            f"Froze {stats['written']} pages, {stats['unchanged']} unchanged,"
+            f" {stats['failed']} failed, {stats['removed']} removed"
+            f" in {time.perf_counter() - start:.2f}s"
+        )
+        if interval is None:
+            break
+        force = False
+        time.sleep(interval)
+
+def init_app(app):
+    app.cli.add_command(freeze_command)
+    register_pages(app, lambda: [
+        url_for("public.index"),
+        url_for("status.index"),
+        url_for("characters.index"),
+        url_for("deaths.index")
+    ])
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# MIT License
+#
+# Copyright (c) 2023 Iñaki Amatria-Barral
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import click
+
+from flask import g
+from flask import abort
+from flask import url_for
+from flask import Blueprint
+from flask import render_template
+
+from .db import get_worlds
+from .cache import cache
+from .freeze import register_pages
+
+from .model import get_guild
+from .model import get_guilds
+from .model import refresh_guilds
+
+bp = Blueprint("guilds", __name__)
+
+@bp.route("/guilds")
+def index():
+    try:
+        guilds = get_guilds()
+    except:
+        return render_template("guilds/index.html", error=True)
+    return render_template("guilds/index.html", guilds=guilds)
+
+@bp.route("/guild/<name>")
+def guild(name):
+    try:
+        guild = get_guild(name)
+    except:
+        return render_template("guilds/guild.html", name=name, error=True)
+    if guild is None:
+        abort(404)
+    return render_template("guilds/guild.html", guild=guild)
+
+@click.command(
+    "refresh-guilds",
+    help="Refresh the member counts and levels of the guilds that changed."
+)
+@click.option(
+    "--world",
+    "worlds",
+    multiple=True,
+    help="Only refresh this world, can be repeated. Defaults to all."
+)
+def refresh_guilds_command(worlds):
+    num_changed = 0
+    for world in worlds or get_worlds():
+        g.world = world
+        try:
+            changed = refresh_guilds()
+        except Exception as e:
+            raise click.UsageError(message=f"{world}: {e}")
+        click.echo(f"Refreshed the guilds of {world} ({changed} changes)")
+        num_changed += changed
+    if num_changed:
+        cache.invalidate("guilds")
+
+def init_app(app):
+    app.cli.add_command(refresh_guilds_command)
+    register_pages(app, lambda: [url_for("guilds.index")])
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# MIT License
+#
+# Copyright (c) 2023 Iñaki Amatria-Barral
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import click
+
+from flask import g
+from flask import abort
+from flask import request
+from flask import url_for
+from flask import Blueprint
+from flask import current_app
+from flask import render_template
+
+from .db import get_worlds
+from .cache import cache
+from .freeze import register_pages
+from .worlds import fan_out
+
+from .model import get_highscores
+from .model import refresh_highscores
+from .model import get_num_highscores
+from .model import HIGHSCORES_CATEGORIES
+
+CATEGORY_NAMES = {
+    "level": "Level",
+    "magic": "Magic level",
+    "fist": "Fist fighting",
+    "club": "Club fighting",
+    "sword": "Sword fighting",
+    "axe": "Axe fighting",
+    "distance": "Distance fighting",
+    "shielding": "Shielding",
+    "fishing": "Fishing"
+}
+
+class WorldsUnavailableError(Exception): ...
+
+bp = Blueprint("highscores", __name__)
+
+def _get_world_highscores(category, limit):
+    return get_num_highscores(category), get_highscores(category, 1, limit)
+
+def get_combined_highscores(category, page, page_size):
+    # Every world ranks its own players, the top page * page_size of each
+    # is enough to rank the first pages of all of them together
+    results, failed = fan_out(
+        _get_world_highscores,
+        category,
+        page * page_size
+    )
+    if not results:
+        raise WorldsUnavailableError("No world answered")
+    entries = sorted(
+        (
+            dict(entry, world=world)
+            for world, (_, highscores) in results.items()
+            for entry in highscores
+        ),
+        key=lambda entry: entry["value"],
+        reverse=True
+    )
+    start = (page - 1) * page_size
+    highscores = [
+        dict(entry, position=start + i + 1)
+        for i, entry in enumerate(entries[start:start + page_size])
+    ]
+    num_highscores = sum(total for total, _ in results.values())
+    return num_highscores, highscores, failed
+
+@bp.route("/highscores", defaults={"category": "level"})
+@bp.route("/highscores/<category>")
+def index(category):
+    if category not in HIGHSCORES_CATEGORIES:
+        abort(404)
+    page = request.args.get("page", 1, type=int)
+    if page < 1:
+        abort(404)
+    page_size = current_app.config["OT_HIGHSCORES_PAGE_SIZE"]
+    combined = request.args.get("world") == "all"
+
+    failed = []
+    try:
+        if combined:
+            num_highscores, highscores, failed = get_combined_highscores(
+                category,
+                page,
+                page_size
+            )
+        else:
+            num_highscores = get_num_highscores(category)
+            highscores = get_highscores(category, page, page_size)
+    except:
+        return render_template(
+            "highscores/index.html",
+            category=category,
+            categories=CATEGORY_NAMES,
+            combined=combined,
+            error=True
+        )
+    num_pages = max((num_highscores + page_size - 1) // page_size, 1)
+    if page > num_pages:
+        abort(404)
+
+    return render_template(
+        "highscores/index.html",
+        category=category,
+        categories=CATEGORY_NAMES,
+        combined=combined,
+        failed_worlds=failed,
+        highscores=highscores,
+        page=page,
+        num_pages=num_pages
+    )
+
+@click.command(
+    "refresh-highscores",
+    help="Refresh the highscores of the players that changed."
+)
+@click.option(
+    "--world",
+    "worlds",
+    multiple=True,
+    help="Only refresh this world, can be repeated. Defaults to all."
+)
+def refresh_highscores_command(worlds):
+    num_changed = 0
+    for world in worlds or get_worlds():
+        g.world = world
+        try:
+            changed = refresh_highscores(
+                current_app.config["OT_HIGHSCORES_MAX_GROUP_ID"]
+            )
+        except Exception as e:
+            raise click.UsageError(message=f"{world}: {e}")
+        click.echo(f"Refreshed the highscores of {world} ({changed} changes)")
+        num_changed += changed
+    if num_changed:
+        cache.invalidate("highscores")
+
+def init_app(app):
+    app.cli.add_command(refresh_highscores_command)
+    register_pages(app, lambda: [
+        url_for("highscores.index", category=category)
+        for category in CATEGORY_NAMES
+    ])
@@ -0,0 +1,361 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# MIT License
+#
+# Copyright (c) 2023 Iñaki Amatria-Barral
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import re
+import json
+import time
+import fcntl
+import bisect
+import threading
+import contextlib
+
+from flask import g
+from flask import abort
+from flask import request
+from flask import Response
+from flask import Blueprint
+from flask import current_app
+
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_literals = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"|\b\d+\b")
+_lists = re.compile(r"\((?:\s*(?:%s|\?)\s*,)+\s*(?:%s|\?)\s*\)")
+_spaces = re.compile(r"\s+")
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.fingerprints = {}
+        self.reset()
+
+    def reset(self):
+        self.pid = os.getpid()
+        # Tells this process apart from an older one that had the same pid
+        self.token = os.urandom(8).hex()
+        self.flushed = False
+        self.last_flush = 0.0
+        self.counters = {}
+        self.histograms = {}
+
+    def _check_pid(self):
+        # Numbers inherited from the parent of a fork belong to the parent
+        if self.pid != os.getpid():
+            self.reset()
+
+    def inc(self, name, labels, value=1):
+        key = (name, labels)
+        with self.lock:
+            self._check_pid()
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, labels, seconds):
+        key = (name, labels)
+        with self.lock:
+            self._check_pid()
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [0] * (len(BUCKETS) + 3)
+            histogram[bisect.bisect_left(BUCKETS, seconds)] += 1
+            histogram[-2] += seconds
+            histogram[-1] += 1
+
+    def fingerprint(self, query):
+        fingerprint = self.fingerprints.get(query)
+        if fingerprint is None:
+            fingerprint = _literals.sub("?", query)
+            fingerprint = _lists.sub("(?)", _spaces.sub(" ", fingerprint))
+            fingerprint = fingerprint.strip()[:200]
+            if len(self.fingerprints) < 1024:
+                self.fingerprints[query] = fingerprint
+        return fingerprint
+
+    def snapshot(self):
+        with self.lock:
+            self._check_pid()
+            return {
+                "token": self.token,
+                "counters": [
+                    [name, list(labels), value]
+                    for (name, labels), value in self.counters.items()
+                ],
+                "histograms": [
+                    [name, list(labels), list(values)]
+                    for (name, labels), values in self.histograms.items()
+                ]
+            }
+
+metrics = Metrics()
+
+def observe_query(query, seconds):
+    statement = (("statement", metrics.fingerprint(query)), )
+    metrics.inc("pcarrot_sql_queries_total", statement)
+    metrics.observe("pcarrot_sql_query_duration_seconds", statement, seconds)
+
+def observe_memoize(function, hit):
+    metrics.inc(
+        "pcarrot_cache_memoize_total",
+        (("function", function), ("result", "hit" if hit else "miss"))
+    )
+
+def _get_gauges():
+    from .cache import get_cache_stats
+
+    gauges = {}
+    # Summed over the primary pools of every world
+    for key, entry in list(current_app.extensions.items()):
+        if not key.startswith("pcarrot_pool.") or entry[0] != os.getpid():
+            continue
+        stats = entry[1].stats()
+        for gauge, stat in (
+            ("pcarrot_db_pool_in_use", "in_use"),
+            ("pcarrot_db_pool_idle", "idle"),
+            ("pcarrot_db_pool_wait_seconds_total", "wait_time_total"),
+            ("pcarrot_db_pool_waits_total", "waits"),
+            ("pcarrot_db_pool_timeouts_total", "timeouts")
+        ):
+            gauges[gauge] = gauges.get(gauge, 0) + stats[stat]
+    for tier, stats in get_cache_stats().items():
+        for key in ("hits", "misses", "evictions"):
+            gauges[f"pcarrot_cache_{tier}_{key}_total"] = stats[key]
+    return gauges
+
+AGGREGATE = "aggregate.json"
+
+@contextlib.contextmanager
+def _lock_directory(directory):
+    with open(os.path.join(directory, ".lock"), "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def _read_snapshot(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _write_snapshot(path, snapshot):
+    with open(path + ".tmp", "w") as f:
+        json.dump(snapshot, f)
+    os.replace(path + ".tmp", path)
+
+def _merge(counters, histograms, snapshot):
+    for name, labels, value in snapshot["counters"]:
+        key = (name, tuple(map(tuple, labels)))
+        counters[key] = counters.get(key, 0) + value
+    for name, labels, values in snapshot["histograms"]:
+        key = (name, tuple(map(tuple, labels)))
+        total = histograms.setdefault(key, [0] * len(values))
+        for i, value in enumerate(values):
+            total[i] += value
+
+def _retire(directory, path):
+    # Folds the numbers of a worker that is gone into the aggregate file, so
+    # the totals neither lose them nor keep one file per worker ever started.
+    # Must be called with the directory locked
+    snapshot = _read_snapshot(path)
+    if snapshot is not None:
+        counters = {}
+        histograms = {}
+        aggregate = _read_snapshot(os.path.join(directory, AGGREGATE))
+        if aggregate is not None:
+            _merge(counters, histograms, aggregate)
+        _merge(counters, histograms, snapshot)
+        _write_snapshot(os.path.join(directory, AGGREGATE), {
+            "counters": [
+                [name, list(labels), value]
+                for (name, labels), value in counters.items()
+            ],
+            "histograms": [
+                [name, list(labels), values]
+                for (name, labels), values in histograms.items()
+            ]
+        })
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(path)
+
+def mark_process_dead(pid, directory=None):
+    # Meant for the child_exit hook of the server, collect() does the same
+    # for any worker it finds dead
+    directory = directory or current_app.config["OT_METRICS_DIR"]
+    os.makedirs(directory, exist_ok=True)
+    with _lock_directory(directory):
+        _retire(directory, os.path.join(directory, f"{pid}.json"))
+
+def flush():
+    directory = current_app.config["OT_METRICS_DIR"]
+    os.makedirs(directory, exist_ok=True)
+    snapshot = metrics.snapshot()
+    snapshot["gauges"] = _get_gauges()
+    path = os.path.join(directory, f"{os.getpid()}.json")
+    if not metrics.flushed:
+        # A file left by an older process with our pid would be overwritten
+        # and its counters would go backwards
+        with _lock_directory(directory):
+            previous = _read_snapshot(path)
+            if previous is not None and previous.get("token") != metrics.token:
+                _retire(directory, path)
+            _write_snapshot(path, snapshot)
+        metrics.flushed = True
+    else:
+        _write_snapshot(path, snapshot)
+    metrics.last_flush = time.monotonic()
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def collect():
+    # Every worker flushes its own numbers to OT_METRICS_DIR, the scrape sums
+    # all of them so the totals do not depend on which worker answers it
+    counters = {}
+    histograms = {}
+    gauges = {}
+    directory = current_app.config["OT_METRICS_DIR"]
+    with _lock_directory(directory):
+        for filename in os.listdir(directory):
+            if filename == AGGREGATE or not filename.endswith(".json"):
+                continue
+            path = os.path.join(directory, filename)
+            if not _pid_alive(int(filename[:-len(".json")])):
+                _retire(directory, path)
+                continue
+            snapshot = _read_snapshot(path)
+            if snapshot is None:
+                continue
+            _merge(counters, histograms, snapshot)
+            for name, value in snapshot["gauges"].items():
+                gauges[name] = gauges.get(name, 0) + value
+        aggregate = _read_snapshot(os.path.join(directory, AGGREGATE))
+        if aggregate is not None:
+            _merge(counters, histograms, aggregate)
+    return counters, histograms, gauges
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(
+        '{}="{}"'.format(
+            name,
+            str(value).replace("\\", "\\\\").replace('"', '\\"')
+            .replace("\n", "\\n")
+        )
+        for name, value in labels
+    ) + "}"
+
+def render_metrics(counters, histograms, gauges):
+    lines = []
+    for name in sorted({name for name, _ in counters}):
+        lines.append(f"# TYPE {name} counter")
+        for (n, labels), value in sorted(counters.items()):
+            if n == name:
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+    for name in sorted({name for name, _ in histograms}):
+        lines.append(f"# TYPE {name} histogram")
+        for (n, labels), values in sorted(histograms.items()):
+            if n != name:
+                continue
+            cumulative = 0
+            for bound, value in zip(BUCKETS + ("+Inf", ), values):
+                cumulative += value
+                bucket_labels = labels + (("le", bound), )
+                lines.append(
+                    f"{name}_bucket{_format_labels(bucket_labels)} {cumulative}"
+                )
+            lines.append(f"{name}_sum{_format_labels(labels)} {values[-2]}")
+            lines.append(f"{name}_count{_format_labels(labels)} {values[-1]}")
+    for name, value in sorted(gauges.items()):
+        kind = "counter" if name.endswith("_total") else "gauge"
+        lines.append(f"# TYPE {name} {kind}")
+        lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+bp = Blueprint("metrics", __name__)
+
+@bp.route("/metrics")
+def index():
+    token = current_app.config["OT_METRICS_TOKEN"]
+    if not (
+        request.remote_addr in current_app.config["OT_METRICS_ALLOWED_ADDRS"]
+        or token and request.headers.get("Authorization") == f"Bearer {token}"
+    ):
+        abort(404)
+    flush()
+    return Response(
+        render_metrics(*collect()),
+        mimetype="text/plain; version=0.0.4"
+    )
+
+def init_app(app):
+    @app.before_request
+    def start_request_timer():
+        g.request_start = time.perf_counter()
+
+    @app.after_request
+    def observe_request(response):
+        start = g.pop("request_start", None)
+        if start is not None:
+            endpoint = (("endpoint", request.endpoint or "none"), )
+            metrics.observe(
+                "pcarrot_request_duration_seconds",
+                endpoint,
+                time.perf_counter() - start
+            )
+            metrics.inc(
+                "pcarrot_requests_total",
+                endpoint + (("status", response.status_code), )
+            )
+        if time.monotonic() - metrics.last_flush > app.config[
+            "OT_METRICS_FLUSH_INTERVAL"
+        ]:
+            try:
+                flush()
+            except OSError:
+                app.logger.exception("Could not flush the metrics")
+        return response
+
+    @app.teardown_request
+    def observe_failed_request(e=None):
+        start = g.pop("request_start", None)
+        if start is not None and e is not None:
+            endpoint = (("endpoint", request.endpoint or "none"), )
+            metrics.observe(
+                "pcarrot_request_duration_seconds",
+                endpoint,
+                time.perf_counter() - start
+            )
+            metrics.inc(
+                "pcarrot_requests_total",
+                endpoint + (("status", 500), )
+            )
@@ -0,0 +1,283 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# MIT License
+#
+# Copyright (c) 2023 Iñaki Amatria-Barral
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import re
+import click
+import hashlib
+import importlib.util
+
+from flask import g
+
+from .db import get_db
+from .db import get_worlds
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(__file__), "migrations")
+
+_migration_name = re.compile(r"^(\d+)_(\w+)\.(sql|py)$")
+
+class MigrationError(Exception): ...
+
+class Migration:
+    def __init__(self, version, name, path):
+        self.version = version
+        self.name = name
+        self.path = path
+        with open(path, "rb") as f:
+            self.source = f.read()
+        self.checksum = hashlib.sha256(self.source).hexdigest()
+
+    def __str__(self):
+        return f"{self.version:04d}_{self.name}"
+
+    def run(self, db, echo):
+        if self.path.endswith(".py"):
+            spec = importlib.util.spec_from_file_location(
+                f"pCarrot.migrations.m{self.version:04d}",
+                self.path
+            )
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            module.upgrade(db, echo)
+            return
+        for statement in split_sql(self.source.decode("utf-8")):
+            with db.cursor() as cursor:
+                cursor.execute(statement)
+
+# Splits on the semicolons that end statements, not on the ones inside
+# strings, quoted identifiers or comments
+def split_sql(sql):
+    statements = []
+    start = 0
+    i = 0
+    quote = None
+    while i < len(sql):
+        c = sql[i]
+        if quote is not None:
+            if c == "\\" and quote != "`":
+                i += 1
+            elif c == quote:
+                if sql[i + 1:i + 2] == quote:
+                    i += 1
+                else:
+                    quote = None
+        elif c in "'\"`":
+            quote = c
+        elif c == "#" or sql.startswith("-- ", i) or sql.startswith("--\n", i):
+            end = sql.find("\n", i)
+            i = len(sql) if end < 0 else end
+        elif sql.startswith("/*", i):
+            end = sql.find("*/", i + 2)
+            i = len(sql) if end < 0 else end + 1
+        elif c == ";":
+            statements.append(sql[start:i])
+            start = i + 1
+        i += 1
+    statements.append(sql[start:])
+    return [s.strip() for s in statements if _has_code(s)]
+
+def _has_code(statement):
+    statement = re.sub(r"/\*.*?\*/", "", statement, flags=re.S)
+    statement = re.sub(r"(?m)(#|-- |--$).*$", "", statement)
+    return bool(statement.strip())
+
+def get_migrations():
+    migrations = []
+    for filename in sorted(os.listdir(MIGRATIONS_DIR)):
+        match = _migration_name.match(filename)
+        if match is None:
+            continue
+        migrations.append(Migration(
+            int(match.group(1)),
+            match.group(2),
+            os.path.join(MIGRATIONS_DIR, filename)
+        ))
+    versions = [m.version for m in migrations]
+    if len(versions) != len(set(versions)):
+        raise MigrationError("There are migrations with the same version")
+    return sorted(migrations, key=lambda m: m.version)
+
+def _create_migrations_table(db):
+    with db.cursor() as cursor:
+        cursor.execute(
+            "CREATE TABLE IF NOT EXISTS `pcarrot_migrations` ("
+            " `version` INT NOT NULL,"
+            " `name` VARCHAR(255) NOT NULL,"
+            " `checksum` CHAR(64) NOT NULL,"
+            " `applied_at` DATETIME NOT NULL,"
+            " PRIMARY KEY (`version`)"
+            ") ENGINE=InnoDB DEFAULT CHARACTER SET=utf8"
+        )
+
+def get_applied_migrations():
+    db = get_db()
+    _create_migrations_table(db)
+    with db.cursor() as cursor:
+        cursor.execute(
+            "SELECT `version`, `name`, `checksum`, `applied_at`"
+            " FROM `pcarrot_migrations`"
+        )
+        applied = {row["version"]: row for row in cursor.fetchall()}
+    db.commit()
+    return applied
+
+def _mark_applied(db, migration):
+    with db.cursor() as cursor:
+        cursor.execute(
+            "INSERT INTO `pcarrot_migrations`"
+            " (`version`, `name`, `checksum`, `applied_at`)"
+            " VALUES (%s, %s, %s, NOW())",
+            (migration.version, migration.name, migration.checksum)
+        )
+
+class _migration_lock:
+    # Two deploys running at once must not apply the same migration twice
+    def __init__(self, db, timeout=60):
+        self.db = db
+        self.timeout = timeout
+
+    def __enter__(self):
+        with self.db.cursor() as cursor:
+            cursor.execute(
+                "SELECT GET_LOCK('pcarrot_migrations', %s) AS `locked`",
+                (self.timeout, )
+            )
+            if not cursor.fetchone()["locked"]:
+                raise MigrationError("Another migration is already running")
+
+    def __exit__(self, *args):
+        with self.db.cursor() as cursor:
+            cursor.execute("SELECT RELEASE_LOCK('pcarrot_migrations')")
+
+def upgrade(target=None, echo=click.echo):
+    db = get_db()
+    num_applied = 0
+    with _migration_lock(db):
+        applied = get_applied_migrations()
+        for migration in get_migrations():
+            if migration.version in applied:
+                continue
+            if target is not None and migration.version > target:
+                break
+            echo(f"Applying {migration}")
+            # MySQL commits DDL statements implicitly, so only data changes
+            # are rolled back if a migration fails halfway
+            try:
+                migration.run(db, echo)
+                _mark_applied(db, migration)
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                raise MigrationError(f"{migration} failed: {e}")
+            num_applied += 1
+    return num_applied
+
+def stamp(version):
+    db = get_db()
+    with _migration_lock(db):
+        applied = get_applied_migrations()
+        for migration in get_migrations():
+            if migration.version > version:
+                break
+            if migration.version not in applied:
+                _mark_applied(db, migration)
+        db.commit()
+
+def get_status():
+    applied = get_applied_migrations()
+    return [
+        (migration, applied.get(migration.version))
+        for migration in get_migrations()
+    ]
+
+def _each_world(worlds):
+    # Every world is a database of its own with its own migrations
+    worlds = worlds or get_worlds()
+    for world in worlds:
+        g.world = world
+        if len(get_worlds()) > 1:
+            click.echo(f"World {world}")
+        yield world
+
+world_option = click.option(
+    "--world",
+    "worlds",
+    multiple=True,
+    help="Only this world, can be repeated. Defaults to all."
+)
+
+@click.group("db", help="Manage the database migrations.")
+def db_command():
+    pass
+
+@db_command.command("upgrade", help="Apply the pending migrations.")
+@click.option(
+    "--target",
+    type=int,
+    default=None,
+    help="Stop after this migration version."
+)
+@world_option
+def upgrade_command(target, worlds):
+    for _ in _each_world(worlds):
+        try:
+            num_applied = upgrade(target)
+        except Exception as e:
+            raise click.UsageError(message=e)
+        click.echo(f"Applied {num_applied} migrations")
+
+@db_command.command("status", help="Show which migrations were applied.")
+@world_option
+def status_command(worlds):
+    for _ in _each_world(worlds):
+        try:
+            status = get_status()
+        except Exception as e:
+            raise click.UsageError(message=e)
+        for migration, applied in status:
+            if applied is None:
+                state = "pending"
+            elif applied["checksum"] != migration.checksum:
+                state = f"applied {applied['applied_at']} (modified since)"
+            else:
+                state = f"applied {applied['applied_at']}"
+            click.echo(f"{migration}  {state}")
+
+@db_command.command(
+    "stamp",
+    help="Mark migrations up to VERSION as applied without running them."
+)
+@click.argument("version", type=int)
+@world_option
+def stamp_command(version, worlds):
+    for _ in _each_world(worlds):
+        try:
+            stamp(version)
+        except Exception as e:
+            raise click.UsageError(message=e)
+        click.echo(f"Stamped the database at version {version}")
+
+def init_app(app):
+    app.cli.add_command(db_command)
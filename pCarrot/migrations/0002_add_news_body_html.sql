@@ -0,0 +1,3 @@
+ALTER TABLE `pcarrot_news`
+    ADD COLUMN `body_html` TEXT NULL AFTER `body`,
+    ADD COLUMN `body_hash` CHAR(64) NULL AFTER `body_html`;
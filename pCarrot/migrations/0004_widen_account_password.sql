@@ -0,0 +1 @@
+ALTER TABLE `accounts` MODIFY `password` VARCHAR(255) NOT NULL;
@@ -0,0 +1,17 @@
+CREATE TABLE IF NOT EXISTS `pcarrot_highscores` (
+    `category` VARCHAR(16) NOT NULL,
+    `player_id` INT NOT NULL,
+    `name` VARCHAR(255) NOT NULL,
+    `vocation` INT NOT NULL,
+    `level` INT NOT NULL,
+    `value` BIGINT UNSIGNED NOT NULL,
+    `position` INT UNSIGNED NOT NULL DEFAULT 0,
+    PRIMARY KEY (`category`, `player_id`),
+    KEY `category_position` (`category`, `position`)
+) ENGINE=InnoDB DEFAULT CHARACTER SET=utf8;
+
+CREATE TABLE IF NOT EXISTS `pcarrot_highscores_state` (
+    `id` TINYINT NOT NULL,
+    `last_refresh` BIGINT NOT NULL,
+    PRIMARY KEY (`id`)
+) ENGINE=InnoDB DEFAULT CHARACTER SET=utf8;
@@ -0,0 +1 @@
+CREATE INDEX `time_player_id` ON `player_deaths` (`time`, `player_id`);
@@ -0,0 +1,3 @@
+ALTER TABLE `pcarrot_news` ADD KEY `date_id` (`date`, `id`);
+
+ALTER TABLE `pcarrot_news` ADD FULLTEXT KEY `title_body` (`title`, `body`);
@@ -0,0 +1,15 @@
+CREATE TABLE IF NOT EXISTS `pcarrot_guilds` (
+    `guild_id` INT NOT NULL,
+    `name` VARCHAR(255) NOT NULL,
+    `num_members` INT UNSIGNED NOT NULL,
+    `avg_level` INT UNSIGNED NOT NULL,
+    `members_hash` BIGINT UNSIGNED NOT NULL,
+    PRIMARY KEY (`guild_id`),
+    KEY `name` (`name`)
+) ENGINE=InnoDB DEFAULT CHARACTER SET=utf8;
+
+CREATE TABLE IF NOT EXISTS `pcarrot_guilds_state` (
+    `id` TINYINT NOT NULL,
+    `last_refresh` BIGINT NOT NULL,
+    PRIMARY KEY (`id`)
+) ENGINE=InnoDB DEFAULT CHARACTER SET=utf8;
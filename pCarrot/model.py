@@ -23,65 +23,516 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import re
+import json
 import time
-import markdown
+
+from pymysql.err import IntegrityError
+from pymysql.constants import ER
 
 from .db import get_db
+from .db import get_read_db
+from .db import get_home_world
 from .cache import cache
 
 class AccountNotFoundError(Exception): ...
 class AccountNameInUseError(Exception): ...
 class AccountChangePasswordError(Exception): ...
 
-@cache.memoize()
+# News and accounts are not tied to a world, they live in the home world
+@cache.memoize(
+    timeout=3600,
+    stale_timeout=86400,
+    namespace="news",
+    per_world=False
+)
 def get_latest_news(num_latest_news):
-    with get_db().cursor() as cursor:
+    with get_read_db(get_home_world()).cursor() as cursor:
         cursor.execute(
-            "SELECT * FROM `pcarrot_news` ORDER BY `date` DESC LIMIT %s",
+            "SELECT `id`, `title`, `body`, `body_html`, `date`"
+            " FROM `pcarrot_news` ORDER BY `date` DESC LIMIT %s",
             (num_latest_news, )
         )
+        return cursor.fetchall()
+
+# Seeks past the last (date, id) shown instead of using an offset, so every
+# page costs the same however deep it is
+@cache.memoize(timeout=3600, namespace="news", per_world=False)
+def get_news_page(before, page_size):
+    query = (
+        "SELECT `id`, `title`, `body`, `body_html`, `date`"
+        " FROM `pcarrot_news`"
+    )
+    args = ()
+    if before is not None:
+        query += " WHERE `date` < %s OR (`date` = %s AND `id` < %s)"
+        args = (before[0], before[0], before[1])
+    # One extra row tells whether there is a next page
+    query += " ORDER BY `date` DESC, `id` DESC LIMIT %s"
+    with get_read_db(get_home_world()).cursor() as cursor:
+        cursor.execute(query, args + (page_size + 1, ))
         news = cursor.fetchall()
-        for n in news:
-            n["body"] = markdown.markdown(n["body"])
-        return news
+    return news[:page_size], len(news) > page_size
+
+@cache.memoize(timeout=600, namespace="news", per_world=False)
+def search_news(terms, limit):
+    with get_read_db(get_home_world()).cursor() as cursor:
+        cursor.execute(
+            "SELECT `id`, `title`, `body`, `body_html`, `date`,"
+            " MATCH (`title`, `body`) AGAINST (%s) AS `score`"
+            " FROM `pcarrot_news` WHERE MATCH (`title`, `body`) AGAINST (%s)"
+            " ORDER BY `score` DESC, `date` DESC LIMIT %s",
+            (terms, terms, limit)
+        )
+        return cursor.fetchall()
+
+def add_news(title, body, body_html, body_hash):
+    db = get_db(get_home_world())
+    with db.cursor() as cursor:
+        cursor.execute(
+            "INSERT INTO `pcarrot_news`"
+            " (`title`, `body`, `body_html`, `body_hash`, `date`)"
+            " VALUES (%s, %s, %s, %s, NOW())",
+            (title, body, body_html, body_hash)
+        )
+        news_id = cursor.lastrowid
+    db.commit()
+    return news_id
+
+def get_news_to_render(after_id, batch_size, force=False, db=None):
+    query = "SELECT `id`, `body` FROM `pcarrot_news` WHERE `id` > %s"
+    if not force:
+        query += (
+            " AND (`body_html` IS NULL OR `body_hash` IS NULL"
+            " OR `body_hash` <> SHA2(`body`, 256))"
+        )
+    query += " ORDER BY `id` LIMIT %s"
+    with (db or get_db(get_home_world())).cursor() as cursor:
+        cursor.execute(query, (after_id, batch_size))
+        return cursor.fetchall()
+
+def update_news_html(rendered_news, db=None):
+    db = db or get_db(get_home_world())
+    with db.cursor() as cursor:
+        cursor.executemany(
+            "UPDATE `pcarrot_news` SET `body_html` = %s, `body_hash` = %s"
+            " WHERE `id` = %s",
+            rendered_news
+        )
+    db.commit()
 
 def register_new_account(account_name, password):
+    db = get_db(get_home_world())
+    try:
+        with db.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO `accounts` (`name`, `password`, `creation`)"
+                " VALUES (%s, %s, %s)",
+                (account_name, password, int(time.time()))
+            )
+    except IntegrityError as e:
+        db.rollback()
+        if e.args[0] == ER.DUP_ENTRY:
+            raise AccountNameInUseError("Account name already in use")
+        raise
+    db.commit()
+
+def change_account_password(account_id, old_password, new_password):
+    db = get_db(get_home_world())
+    with db.cursor() as cursor:
+        num_updated = cursor.execute(
+            "UPDATE `accounts` SET `password` = %s"
+            " WHERE `id` = %s AND `password` = %s",
+            (new_password, account_id, old_password)
+        )
+    if not num_updated:
+        db.rollback()
+        raise AccountChangePasswordError("Invalid current password")
+    db.commit()
+
+def import_accounts(accounts):
+    db = get_db(get_home_world())
+    with db.cursor() as cursor:
+        # Existing names are left untouched and not counted as imported
+        num_imported = cursor.executemany(
+            "INSERT INTO `accounts` (`name`, `password`, `email`, `creation`)"
+            " VALUES (%s, %s, %s, %s)"
+            " ON DUPLICATE KEY UPDATE `id` = `id`",
+            accounts
+        )
+    db.commit()
+    return num_imported
+
+def get_account(account_name):
+    with get_read_db(get_home_world()).cursor() as cursor:
+        cursor.execute(
+            "SELECT `id`, `password` FROM `accounts` WHERE `name` = %s",
+            (account_name, )
+        )
+        account = cursor.fetchone()
+        if account is None:
+            raise AccountNotFoundError("Invalid account name or password")
+        return account
+
+def get_account_password(account_id):
+    with get_db(get_home_world()).cursor() as cursor:
+        cursor.execute(
+            "SELECT `password` FROM `accounts` WHERE `id` = %s",
+            (account_id, )
+        )
+        account = cursor.fetchone()
+        if account is None:
+            raise AccountNotFoundError("Account not found")
+        return account["password"]
+
+def rehash_account_password(account_id, old_password, new_password):
+    db = get_db(get_home_world())
+    with db.cursor() as cursor:
+        cursor.execute(
+            "UPDATE `accounts` SET `password` = %s"
+            " WHERE `id` = %s AND `password` = %s",
+            (new_password, account_id, old_password)
+        )
+    db.commit()
+
+HIGHSCORES_CATEGORIES = {
+    "level": "experience",
+    "magic": "maglevel",
+    "fist": "skill_fist",
+    "club": "skill_club",
+    "sword": "skill_sword",
+    "axe": "skill_axe",
+    "distance": "skill_dist",
+    "shielding": "skill_shielding",
+    "fishing": "skill_fishing"
+}
+
+@cache.memoize(timeout=86400, namespace="highscores")
+def get_highscores(category, page, page_size):
+    with get_read_db().cursor() as cursor:
+        cursor.execute(
+            "SELECT `position`, `name`, `vocation`, `level`, `value`"
+            " FROM `pcarrot_highscores`"
+            " WHERE `category` = %s AND `position` > %s"
+            " ORDER BY `position` LIMIT %s",
+            (category, (page - 1) * page_size, page_size)
+        )
+        return cursor.fetchall()
+
+@cache.memoize(timeout=86400, namespace="highscores")
+def get_num_highscores(category):
+    with get_read_db().cursor() as cursor:
+        cursor.execute(
+            "SELECT MAX(`position`) AS `total` FROM `pcarrot_highscores`"
+            " WHERE `category` = %s",
+            (category, )
+        )
+        return cursor.fetchone()["total"] or 0
+
+def refresh_highscores(max_group_id):
     db = get_db()
+    now = int(time.time())
+    num_changed = 0
     with db.cursor() as cursor:
         cursor.execute(
-            "SELECT * FROM `accounts` WHERE `name` = %s", (account_name, )
+            "SELECT `last_refresh` FROM `pcarrot_highscores_state`"
+            " WHERE `id` = 1 FOR UPDATE"
         )
-        if cursor.fetchone():
-            raise AccountNameInUseError("Account name already in use")
+        state = cursor.fetchone()
+        last_refresh = 0 if state is None else state["last_refresh"]
+
+        # Skills only change while playing, so only players that logged in
+        # since the last refresh, are still online or are new need a look
+        for category, column in HIGHSCORES_CATEGORIES.items():
+            num_changed += cursor.execute(
+                "INSERT INTO `pcarrot_highscores`"
+                " (`category`, `player_id`, `name`, `vocation`, `level`,"
+                " `value`)"
+                f" SELECT %s, p.`id`, p.`name`, p.`vocation`, p.`level`,"
+                f" p.`{column}`"
+                " FROM `players` p"
+                " WHERE p.`deletion` = 0 AND p.`group_id` <= %s AND ("
+                " p.`lastlogin` >= %s OR p.`lastlogout` >= %s"
+                " OR p.`id` IN (SELECT `player_id` FROM `players_online`)"
+                " OR NOT EXISTS (SELECT 1 FROM `pcarrot_highscores` h"
+                " WHERE h.`category` = %s AND h.`player_id` = p.`id`))"
+                " ON DUPLICATE KEY UPDATE `name` = VALUES(`name`),"
+                " `vocation` = VALUES(`vocation`), `level` = VALUES(`level`),"
+                " `value` = VALUES(`value`)",
+                (category, max_group_id, last_refresh, last_refresh, category)
+            )
+
+        num_changed += cursor.execute(
+            "DELETE h FROM `pcarrot_highscores` h"
+            " LEFT JOIN `players` p ON p.`id` = h.`player_id`"
+            " WHERE p.`id` IS NULL OR p.`deletion` <> 0 OR p.`group_id` > %s",
+            (max_group_id, )
+        )
+
+        if num_changed:
+            cursor.execute(
+                "UPDATE `pcarrot_highscores` h JOIN ("
+                " SELECT `category`, `player_id`, ROW_NUMBER() OVER ("
+                " PARTITION BY `category` ORDER BY `value` DESC, `player_id`"
+                " ) AS `position` FROM `pcarrot_highscores`"
+                " ) r USING (`category`, `player_id`)"
+                " SET h.`position` = r.`position`"
+                " WHERE h.`position` <> r.`position`"
+            )
+
         cursor.execute(
-            "INSERT INTO `accounts` (`name`, `password`, `creation`)"
-            " VALUES (%s, %s, %s)",
-            (account_name, password, int(time.time()))
+            "INSERT INTO `pcarrot_highscores_state` (`id`, `last_refresh`)"
+            " VALUES (1, %s)"
+            " ON DUPLICATE KEY UPDATE `last_refresh` = VALUES(`last_refresh`)",
+            (now, )
         )
     db.commit()
+    return num_changed
 
-def change_account_password(account_id, old_password, new_password):
+@cache.memoize(timeout=86400, namespace="guilds")
+def get_guilds():
+    with get_read_db().cursor() as cursor:
+        cursor.execute(
+            "SELECT `name`, `num_members`, `avg_level` FROM `pcarrot_guilds`"
+            " ORDER BY `name`"
+        )
+        return cursor.fetchall()
+
+# Ranks, members and online flags in one set based query, empty ranks come
+# back as a single row without a member
+@cache.memoize(timeout=60, namespace="guilds", cache_none=True)
+def get_guild(name):
+    with get_read_db().cursor() as cursor:
+        cursor.execute(
+            "SELECT g.`name`, g.`motd`, g.`creationdata`,"
+            " w.`name` AS `owner`, r.`id` AS `rank_id`, r.`name` AS `rank`,"
+            " p.`name` AS `member`, p.`level`, p.`vocation`, m.`nick`,"
+            " o.`player_id` IS NOT NULL AS `online`"
+            " FROM `guilds` g"
+            " LEFT JOIN `players` w ON w.`id` = g.`ownerid`"
+            " LEFT JOIN `guild_ranks` r ON r.`guild_id` = g.`id`"
+            " LEFT JOIN `guild_membership` m ON m.`rank_id` = r.`id`"
+            " LEFT JOIN `players` p ON p.`id` = m.`player_id`"
+            " LEFT JOIN `players_online` o ON o.`player_id` = p.`id`"
+            " WHERE g.`name` = %s"
+            " ORDER BY r.`level` DESC, r.`id`, p.`name`",
+            (name, )
+        )
+        rows = cursor.fetchall()
+    if not rows:
+        return None
+    guild = {
+        "name": rows[0]["name"],
+        "motd": rows[0]["motd"],
+        "creationdata": rows[0]["creationdata"],
+        "owner": rows[0]["owner"],
+        "ranks": [],
+        "num_members": 0,
+        "num_online": 0
+    }
+    for row in rows:
+        if row["rank_id"] is None:
+            continue
+        if not guild["ranks"] or guild["ranks"][-1]["id"] != row["rank_id"]:
+            guild["ranks"].append({
+                "id": row["rank_id"],
+                "name": row["rank"],
+                "members": []
+            })
+        if row["member"] is None:
+            continue
+        guild["ranks"][-1]["members"].append({
+            "name": row["member"],
+            "level": row["level"],
+            "vocation": row["vocation"],
+            "nick": row["nick"],
+            "online": bool(row["online"])
+        })
+        guild["num_members"] += 1
+        guild["num_online"] += bool(row["online"])
+    return guild
+
+def refresh_guilds(batch_size=1000):
     db = get_db()
+    now = int(time.time())
+    num_changed = 0
     with db.cursor() as cursor:
         cursor.execute(
-            "SELECT * FROM `accounts` WHERE `id` = %s AND `password` = %s",
-            (account_id, old_password)
+            "SELECT `last_refresh` FROM `pcarrot_guilds_state`"
+            " WHERE `id` = 1 FOR UPDATE"
+        )
+        state = cursor.fetchone()
+        last_refresh = 0 if state is None else state["last_refresh"]
+
+        # A guild changes when its member list does, which the count and
+        # XOR of its member ids tell from guild_membership alone, or when
+        # one of its members could have levelled up since the last refresh
+        cursor.execute(
+            "SELECT g.`id` FROM `guilds` g"
+            " LEFT JOIN (SELECT `guild_id`, COUNT(*) AS `num_members`,"
+            " BIT_XOR(`player_id`) AS `members_hash`"
+            " FROM `guild_membership` GROUP BY `guild_id`) m"
+            " ON m.`guild_id` = g.`id`"
+            " LEFT JOIN `pcarrot_guilds` s ON s.`guild_id` = g.`id`"
+            " WHERE s.`guild_id` IS NULL OR s.`name` <> g.`name`"
+            " OR s.`num_members` <> COALESCE(m.`num_members`, 0)"
+            " OR s.`members_hash` <> COALESCE(m.`members_hash`, 0)"
+            " UNION SELECT m.`guild_id` FROM `guild_membership` m"
+            " JOIN `players` p ON p.`id` = m.`player_id`"
+            " WHERE p.`lastlogin` >= %s OR p.`lastlogout` >= %s"
+            " OR p.`id` IN (SELECT `player_id` FROM `players_online`)",
+            (last_refresh, last_refresh)
+        )
+        guild_ids = [row["id"] for row in cursor.fetchall()]
+
+        for i in range(0, len(guild_ids), batch_size):
+            batch = guild_ids[i:i + batch_size]
+            placeholders = ", ".join(["%s"] * len(batch))
+            num_changed += cursor.execute(
+                "INSERT INTO `pcarrot_guilds`"
+                " (`guild_id`, `name`, `num_members`, `avg_level`,"
+                " `members_hash`)"
+                " SELECT g.`id`, g.`name`, COUNT(m.`player_id`),"
+                " COALESCE(ROUND(AVG(p.`level`)), 0),"
+                " COALESCE(BIT_XOR(m.`player_id`), 0)"
+                " FROM `guilds` g"
+                " LEFT JOIN `guild_membership` m ON m.`guild_id` = g.`id`"
+                " LEFT JOIN `players` p ON p.`id` = m.`player_id`"
+                f" WHERE g.`id` IN ({placeholders})"
+                " GROUP BY g.`id`, g.`name`"
+                " ON DUPLICATE KEY UPDATE `name` = VALUES(`name`),"
+                " `num_members` = VALUES(`num_members`),"
+                " `avg_level` = VALUES(`avg_level`),"
+                " `members_hash` = VALUES(`members_hash`)",
+                batch
+            )
+
+        num_changed += cursor.execute(
+            "DELETE s FROM `pcarrot_guilds` s"
+            " LEFT JOIN `guilds` g ON g.`id` = s.`guild_id`"
+            " WHERE g.`id` IS NULL"
         )
-        if not cursor.fetchone():
-            raise AccountChangePasswordError("Invalid current password")
+
         cursor.execute(
-            "UPDATE `accounts` SET `password` = %s WHERE `id` = %s",
-            (new_password, account_id)
+            "INSERT INTO `pcarrot_guilds_state` (`id`, `last_refresh`)"
+            " VALUES (1, %s)"
+            " ON DUPLICATE KEY UPDATE `last_refresh` = VALUES(`last_refresh`)",
+            (now, )
         )
     db.commit()
+    return num_changed
 
-def get_account_id(account_name, password):
-    with get_db().cursor() as cursor:
+# Everything the character page shows comes back in a single row, the lists
+# aggregated as JSON, so a page is one round trip whatever it contains
+@cache.memoize(timeout=60, cache_none=True)
+def get_character(name, deaths_since):
+    with get_read_db().cursor() as cursor:
         cursor.execute(
-            "SELECT id FROM `accounts` WHERE `name` = %s AND `password` = %s",
-            (account_name, password)
+            "SELECT p.`id`, p.`name`, p.`level`, p.`vocation`, p.`sex`,"
+            " p.`lastlogin`,"
+            " EXISTS (SELECT 1 FROM `players_online` o"
+            " WHERE o.`player_id` = p.`id`) AS `online`,"
+            " g.`name` AS `guild_name`, r.`name` AS `guild_rank`,"
+            " m.`nick` AS `guild_nick`,"
+            " (SELECT JSON_ARRAYAGG(JSON_OBJECT("
+            " 'name', a.`name`, 'level', a.`level`,"
+            " 'vocation', a.`vocation`))"
+            " FROM `players` a WHERE a.`account_id` = p.`account_id`"
+            " AND a.`id` <> p.`id` AND a.`deletion` = 0) AS `characters`,"
+            " (SELECT JSON_ARRAYAGG(JSON_OBJECT("
+            " 'time', d.`time`, 'level', d.`level`,"
+            " 'killed_by', d.`killed_by`, 'is_player', d.`is_player`,"
+            " 'mostdamage_by', d.`mostdamage_by`))"
+            " FROM `player_deaths` d WHERE d.`player_id` = p.`id`"
+            " AND d.`time` >= %s) AS `deaths`"
+            " FROM `players` p"
+            " LEFT JOIN `guild_membership` m ON m.`player_id` = p.`id`"
+            " LEFT JOIN `guilds` g ON g.`id` = m.`guild_id`"
+            " LEFT JOIN `guild_ranks` r ON r.`id` = m.`rank_id`"
+            " WHERE p.`name` = %s AND p.`deletion` = 0",
+            (deaths_since, name)
         )
-        account = cursor.fetchone()
-        if account is None:
-            raise AccountNotFoundError("Invalid account name or password")
-        return account["id"]
+        character = cursor.fetchone()
+        if character is None:
+            return None
+        character["characters"] = sorted(
+            json.loads(character["characters"] or "[]"),
+            key=lambda c: c["name"]
+        )
+        character["deaths"] = sorted(
+            json.loads(character["deaths"] or "[]"),
+            key=lambda d: d["time"],
+            reverse=True
+        )
+        return character
+
+@cache.memoize(timeout=60)
+def search_characters(prefix, limit):
+    # A LIKE on a prefix is a range scan of the unique index on the name
+    prefix = re.sub(r"([\\%_])", r"\\\1", prefix)
+    with get_read_db().cursor() as cursor:
+        cursor.execute(
+            "SELECT `name`, `level`, `vocation` FROM `players`"
+            " WHERE `name` LIKE %s AND `deletion` = 0"
+            " ORDER BY `name` LIMIT %s",
+            (prefix + "%", limit)
+        )
+        return cursor.fetchall()
+
+_DEATH_COLUMNS = (
+    "SELECT d.`time`, d.`player_id`, p.`name`, d.`level`, d.`killed_by`,"
+    " d.`is_player`, d.`mostdamage_by`, d.`mostdamage_is_player`"
+    " FROM `player_deaths` d JOIN `players` p ON p.`id` = d.`player_id`"
+)
+
+def get_latest_deaths(limit):
+    with get_read_db().cursor() as cursor:
+        cursor.execute(
+            _DEATH_COLUMNS
+            + " ORDER BY d.`time` DESC, d.`player_id` DESC LIMIT %s",
+            (limit, )
+        )
+        return list(reversed(cursor.fetchall()))
+
+def get_deaths_after(death_time, player_id, limit):
+    # Seek past the (time, player_id) watermark, player_deaths has no id
+    with get_read_db().cursor() as cursor:
+        cursor.execute(
+            _DEATH_COLUMNS
+            + " WHERE d.`time` > %s OR (d.`time` = %s AND d.`player_id` > %s)"
+            " ORDER BY d.`time`, d.`player_id` LIMIT %s",
+            (death_time, death_time, player_id, limit)
+        )
+        return cursor.fetchall()
+
+@cache.memoize(timeout=60)
+def get_characters(names):
+    # Batch lookup, the callers pass a sorted tuple so the cache key is stable
+    placeholders = ", ".join(["%s"] * len(names))
+    with get_read_db().cursor() as cursor:
+        cursor.execute(
+            "SELECT p.`name`, p.`level`, p.`vocation`, p.`sex`,"
+            " p.`lastlogin`,"
+            " EXISTS (SELECT 1 FROM `players_online` o"
+            " WHERE o.`player_id` = p.`id`) AS `online`,"
+            " g.`name` AS `guild_name`, r.`name` AS `guild_rank`"
+            " FROM `players` p"
+            " LEFT JOIN `guild_membership` m ON m.`player_id` = p.`id`"
+            " LEFT JOIN `guilds` g ON g.`id` = m.`guild_id`"
+            " LEFT JOIN `guild_ranks` r ON r.`id` = m.`rank_id`"
+            f" WHERE p.`name` IN ({placeholders}) AND p.`deletion` = 0"
+            " ORDER BY p.`name`",
+            names
+        )
+        return cursor.fetchall()
+
+def get_account_characters(account_name):
+    # Account ids differ between worlds, the name is what they share
+    with get_read_db().cursor() as cursor:
+        cursor.execute(
+            "SELECT p.`name`, p.`level`, p.`vocation` FROM `players` p"
+            " JOIN `accounts` a ON a.`id` = p.`account_id`"
+            " WHERE a.`name` = %s AND p.`deletion` = 0 ORDER BY p.`name`",
+            (account_name, )
+        )
+        return cursor.fetchall()
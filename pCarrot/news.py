@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# MIT License
+#
+# Copyright (c) 2023 Iñaki Amatria-Barral
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import hmac
+import click
+import hashlib
+import datetime
+
+from flask import abort
+from flask import request
+from flask import url_for
+from flask import Blueprint
+from flask import current_app
+from flask import render_template
+
+from .cache import cache
+from .cache import LocalCache
+from .freeze import register_pages
+
+from .model import add_news
+from .model import search_news
+from .model import get_news_page
+from .model import update_news_html
+from .model import get_news_to_render
+
+def hash_news_body(body):
+    return hashlib.sha256(body.encode("utf-8")).hexdigest()
+
+def render_news_body(body):
+    # markdown is only needed when news are written, never on the request path
+    import markdown
+    return markdown.markdown(body)
+
+def publish_news(title, body):
+    news_id = add_news(
+        title,
+        body,
+        render_news_body(body),
+        hash_news_body(body)
+    )
+    cache.invalidate("news")
+    return news_id
+
+# db defaults to the home world, migrations pass the one they upgrade
+def render_news(batch_size=500, force=False, progress=None, db=None):
+    num_rendered = 0
+    after_id = 0
+    while True:
+        news = get_news_to_render(after_id, batch_size, force, db)
+        if not news:
+            break
+        rendered_news = [
+            (render_news_body(n["body"]), hash_news_body(n["body"]), n["id"])
+            for n in news
+        ]
+        update_news_html(rendered_news, db)
+        num_rendered += len(rendered_news)
+        after_id = news[-1]["id"]
+        if progress is not None:
+            progress(num_rendered)
+    if num_rendered:
+        cache.invalidate("news")
+    return num_rendered
+
+# Cursors are signed so that only the ones this app links to get cached,
+# anybody can make up a new one for every request
+def _sign_news_cursor(cursor):
+    key = current_app.secret_key
+    if isinstance(key, str):
+        key = key.encode("utf-8")
+    signature = hmac.new(key, cursor.encode("utf-8"), hashlib.sha256)
+    return signature.hexdigest()[:16]
+
+def format_news_cursor(news):
+    cursor = f"{news['date']:%Y%m%d%H%M%S}-{news['id']}"
+    return f"{cursor}-{_sign_news_cursor(cursor)}"
+
+def parse_news_cursor(cursor):
+    # Returns the (date, id) to seek past and whether the cursor is signed
+    try:
+        date, news_id, *signature = cursor.split("-")
+        before = (
+            datetime.datetime.strptime(date, "%Y%m%d%H%M%S"),
+            int(news_id)
+        )
+    except ValueError:
+        return None
+    if len(signature) > 1:
+        return None
+    signed = bool(signature) and hmac.compare_digest(
+        signature[0],
+        _sign_news_cursor(f"{date}-{news_id}")
+    )
+    return before, signed
+
+def normalize_search_terms(terms):
+    # Searches that only differ in case or spacing share a cache entry
+    return " ".join(terms.lower().split())[:64]
+
+# How many times each worker saw a search lately. Bounded, so a flood of
+# made up terms only pushes out counts, never the shared cache
+_search_counts = LocalCache(threshold=1024, default_timeout=600)
+
+def is_popular_search(terms):
+    count = (_search_counts.get(terms) or 0) + 1
+    _search_counts.set(terms, count)
+    return count >= current_app.config["OT_NEWS_SEARCH_CACHE_MIN_COUNT"]
+
+bp = Blueprint("news", __name__)
+
+@bp.route("/news")
+def index():
+    terms = normalize_search_terms(request.args.get("q", ""))
+    if terms:
+        return search(terms)
+
+    before = None
+    get_page = get_news_page
+    cursor = request.args.get("before")
+    if cursor is not None:
+        parsed = parse_news_cursor(cursor)
+        if parsed is None:
+            abort(404)
+        before, signed = parsed
+        if not signed:
+            get_page = get_news_page.uncached
+    try:
+        news, has_more = get_page(
+            before,
+            current_app.config["OT_NEWS_PAGE_SIZE"]
+        )
+    except:
+        return render_template("news/index.html", error=True)
+    return render_template(
+        "news/index.html",
+        news=news,
+        first_page=before is None,
+        next_cursor=format_news_cursor(news[-1]) if has_more else None
+    )
+
+def search(terms):
+    try:
+        find_news = search_news
+        if not is_popular_search(terms):
+            find_news = search_news.uncached
+        news = find_news(
+            terms,
+            current_app.config["OT_NEWS_SEARCH_LIMIT"]
+        )
+    except:
+        return render_template("news/index.html", terms=terms, error=True)
+    return render_template("news/index.html", terms=terms, news=news)
+
+@click.command("render-news", help="Render the HTML of changed news.")
+@click.option(
+    "--batch-size",
+    default=500,
+    show_default=True,
+    help="Number of news rendered per transaction."
+)
+@click.option(
+    "--force",
+    is_flag=True,
+    help="Render every news, even if its body did not change."
+)
+def render_news_command(batch_size, force):
+    try:
+        num_rendered = render_news(batch_size, force)
+    except Exception as e:
+        raise click.UsageError(message=e)
+    else:
+        click.echo(f"Rendered {num_rendered} news")
+
+def init_app(app):
+    app.cli.add_command(render_news_command)
+    register_pages(app, lambda: [url_for("news.index")])
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# MIT License
+#
+# Copyright (c) 2023 Iñaki Amatria-Barral
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import hashlib
+
+from flask import g
+from flask import request
+from flask import make_response
+
+from .cache import cache
+from .status import get_status
+
+def get_page_variant():
+    # Pages only differ for logged in users because of the navigation bar
+    return "anonymous" if g.account_id is None else "account"
+
+def make_page_version(*parts):
+    return hashlib.sha256(repr(parts).encode("utf-8")).hexdigest()[:16]
+
+def get_header_version():
+    # The header shows the server status, which is not part of page data.
+    # The player count changes with almost every poll, so the page fetches
+    # it on its own instead of being cached once per count
+    status = get_status()
+    if status is None:
+        return "unknown"
+    return str(status["online"])
+
+def cached_page(version, render, last_modified=None):
+    # The query string is not part of the key, it would let anyone fill the
+    # cache with copies of the same page. The world is, because url_for
+    # adds it to every link
+    variant = get_page_variant()
+    key = (
+        f"page:{request.path}:{g.get('world')}:{variant}:"
+        f"{get_header_version()}:{version}"
+    )
+
+    page = cache.get(key)
+    if page is None:
+        body = render()
+        page = {
+            "body": body,
+            "etag": hashlib.sha256(body.encode("utf-8")).hexdigest()
+        }
+        cache.set(key, page)
+
+    response = make_response(page["body"])
+    response.set_etag(page["etag"])
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.cache_control.no_cache = True
+    if variant == "anonymous":
+        response.cache_control.public = True
+    else:
+        response.cache_control.private = True
+    return response.make_conditional(request)
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# MIT License
+#
+# Copyright (c) 2023 Iñaki Amatria-Barral
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import hmac
+import base64
+import hashlib
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from flask import current_app
+
+class PasswordServiceBusyError(Exception): ...
+
+def _b64encode(data):
+    return base64.b64encode(data).decode("ascii")
+
+def _scrypt(password, salt, n, r, p):
+    from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
+    return Scrypt(salt=salt, length=32, n=n, r=r, p=p).derive(
+        password.encode("utf-8")
+    )
+
+def _sha1(password):
+    return hashlib.sha1(password.encode("utf-8")).hexdigest()
+
+# Stored as $scrypt$n$r$p$salt$hash so parameters can be raised later and old
+# hashes still verify (and get upgraded on the next login)
+def _hash(password, scheme, n, r, p):
+    if scheme == "sha1":
+        return _sha1(password)
+    salt = os.urandom(16)
+    key = _scrypt(password, salt, n, r, p)
+    return f"$scrypt${n}${r}${p}${_b64encode(salt)}${_b64encode(key)}"
+
+def _verify(password, password_hash, scheme, n, r, p):
+    if password_hash.startswith("$scrypt$"):
+        try:
+            _, _, hn, hr, hp, salt, key = password_hash.split("$")
+            hn, hr, hp = int(hn), int(hr), int(hp)
+            salt, key = base64.b64decode(salt), base64.b64decode(key)
+        except ValueError:
+            return False, False
+        valid = hmac.compare_digest(_scrypt(password, salt, hn, hr, hp), key)
+        return valid, scheme != "scrypt" or (hn, hr, hp) != (n, r, p)
+    valid = hmac.compare_digest(_sha1(password), password_hash.lower())
+    return valid, scheme != "sha1"
+
+class PasswordService:
+    def __init__(self, config):
+        self.scheme = config["OT_PASSWORD_HASH"]
+        if self.scheme not in ("sha1", "scrypt"):
+            raise ValueError(f"Unknown password hash {self.scheme}")
+        self.params = (
+            config["OT_PASSWORD_SCRYPT_N"],
+            config["OT_PASSWORD_SCRYPT_R"],
+            config["OT_PASSWORD_SCRYPT_P"]
+        )
+        # Checked when the account does not exist, so that costs as much as
+        # a wrong password
+        self.dummy_hash = _hash("", self.scheme, *self.params)
+        self.timeout = config["OT_PASSWORD_TIMEOUT"]
+        workers = config["OT_PASSWORD_WORKERS"]
+        if config["OT_PASSWORD_EXECUTOR"] == "process":
+            self.executor = ProcessPoolExecutor(max_workers=workers)
+        else:
+            self.executor = ThreadPoolExecutor(
+                max_workers=workers,
+                thread_name_prefix="pcarrot-passwords"
+            )
+        # Jobs running plus jobs waiting; anything beyond is turned away at
+        # once instead of piling up behind a login storm
+        self.slots = threading.BoundedSemaphore(
+            workers + config["OT_PASSWORD_QUEUE_SIZE"]
+        )
+
+    def _run(self, fn, *args):
+        if not self.slots.acquire(blocking=False):
+            raise PasswordServiceBusyError(
+                "The server is busy, try again in a few seconds"
+            )
+        try:
+            future = self.executor.submit(fn, *args)
+        except:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda _: self.slots.release())
+        try:
+            return future.result(self.timeout)
+        except FutureTimeoutError:
+            raise PasswordServiceBusyError(
+                "The server is busy, try again in a few seconds"
+            )
+
+    def hash(self, password):
+        return self._run(_hash, password, self.scheme, *self.params)
+
+    def verify(self, password, password_hash):
+        return self._run(
+            _verify, password, password_hash, self.scheme, *self.params
+        )
+
+_service_lock = threading.Lock()
+
+def get_password_service():
+    app = current_app._get_current_object()
+    entry = app.extensions.get("pcarrot_passwords")
+    if entry is None or entry[0] != os.getpid():
+        with _service_lock:
+            entry = app.extensions.get("pcarrot_passwords")
+            if entry is None or entry[0] != os.getpid():
+                entry = (os.getpid(), PasswordService(app.config))
+                app.extensions["pcarrot_passwords"] = entry
+    return entry[1]
+
+def hash_password(password):
+    return get_password_service().hash(password)
+
+def verify_password(password, password_hash):
+    return get_password_service().verify(password, password_hash)
+
+def verify_dummy_password(password):
+    service = get_password_service()
+    service.verify(password, service.dummy_hash)
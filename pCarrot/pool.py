@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# MIT License
+#
+# Copyright (c) 2023 Iñaki Amatria-Barral
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import time
+import threading
+import collections
+
+class PoolTimeoutError(Exception): ...
+
+class ConnectionPool:
+    def __init__(self, connect, min_size=0, max_size=10, timeout=10.0,
+                 max_lifetime=3600.0, ping=True):
+        if max_size < 1:
+            raise ValueError("max_size must be at least 1")
+        self._connect = connect
+        self.min_size = min(max(min_size, 0), max_size)
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.ping = ping
+
+        self._lock = threading.Condition()
+        self._idle = collections.deque()
+        self._created = {}
+        self._in_use = 0
+        self._filled = False
+
+        self._num_created = 0
+        self._num_closed = 0
+        self._num_waits = 0
+        self._num_timeouts = 0
+        self._wait_time_total = 0.0
+        self._wait_time_max = 0.0
+
+    def _open(self):
+        conn = self._connect()
+        with self._lock:
+            self._created[id(conn)] = time.monotonic()
+            self._num_created += 1
+        return conn
+
+    def _discard(self, conn):
+        with self._lock:
+            self._created.pop(id(conn), None)
+            self._num_closed += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _expired(self, conn):
+        created = self._created.get(id(conn))
+        if created is None:
+            return True
+        if self.max_lifetime and self.max_lifetime > 0:
+            return time.monotonic() - created > self.max_lifetime
+        return False
+
+    def _healthy(self, conn):
+        if not self.ping:
+            return True
+        try:
+            conn.ping(reconnect=False)
+        except Exception:
+            return False
+        return True
+
+    def _fill(self):
+        # Best effort: a database that is down at startup must not prevent the
+        # pool from serving requests once it comes back
+        with self._lock:
+            self._filled = True
+            missing = self.min_size - self._in_use - len(self._idle)
+            self._in_use += max(missing, 0)
+        for _ in range(max(missing, 0)):
+            try:
+                conn = self._open()
+            except Exception:
+                with self._lock:
+                    self._in_use -= 1
+                    self._lock.notify()
+                continue
+            with self._lock:
+                self._in_use -= 1
+                self._idle.append(conn)
+                self._lock.notify()
+
+    def acquire(self):
+        if not self._filled:
+            self._fill()
+
+        start = time.monotonic()
+        waited = False
+        with self._lock:
+            while not self._idle and self._in_use >= self.max_size:
+                remaining = self.timeout - (time.monotonic() - start)
+                if remaining <= 0:
+                    self._num_timeouts += 1
+                    raise PoolTimeoutError(
+                        "Timed out waiting for a database connection"
+                    )
+                waited = True
+                self._lock.wait(remaining)
+            conn = self._idle.pop() if self._idle else None
+            self._in_use += 1
+            if waited:
+                wait_time = time.monotonic() - start
+                self._num_waits += 1
+                self._wait_time_total += wait_time
+                self._wait_time_max = max(self._wait_time_max, wait_time)
+
+        try:
+            if conn is not None and (
+                self._expired(conn) or not self._healthy(conn)
+            ):
+                self._discard(conn)
+                conn = None
+            if conn is None:
+                conn = self._open()
+        except Exception:
+            with self._lock:
+                self._in_use -= 1
+                self._lock.notify()
+            raise
+        return conn
+
+    def release(self, conn):
+        reusable = not self._expired(conn)
+        if reusable:
+            # Never hand out a connection with a half finished transaction
+            try:
+                conn.rollback()
+            except Exception:
+                reusable = False
+        if not reusable:
+            self._discard(conn)
+        with self._lock:
+            self._in_use -= 1
+            if reusable:
+                self._idle.append(conn)
+            self._lock.notify()
+
+    def close(self):
+        with self._lock:
+            idle = list(self._idle)
+            self._idle.clear()
+        for conn in idle:
+            self._discard(conn)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "created": self._num_created,
+                "closed": self._num_closed,
+                "waits": self._num_waits,
+                "timeouts": self._num_timeouts,
+                "wait_time_total": self._wait_time_total,
+                "wait_time_max": self._wait_time_max
+            }
@@ -27,6 +27,9 @@ from flask import Blueprint
 from flask import current_app
 from flask import render_template
 
+from .pages import cached_page
+from .pages import make_page_version
+
 from .model import get_latest_news
 
 bp = Blueprint("public", __name__)
@@ -37,7 +40,10 @@ def index():
         latest_news = get_latest_news(current_app.config["OT_NUM_LATEST_NEWS"])
     except:
         return render_template("public/index.html", error=True)
-    return render_template(
-        "public/index.html",
-        latest_news=latest_news
+    return cached_page(
+        make_page_version(
+            [(n["id"], n["date"], n["title"], n["body_html"]) for n in latest_news]
+        ),
+        lambda: render_template("public/index.html", latest_news=latest_news),
+        last_modified=max((n["date"] for n in latest_news), default=None)
     )
@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# MIT License
+#
+# Copyright (c) 2023 Iñaki Amatria-Barral
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import math
+import mmap
+import time
+import fcntl
+import struct
+import hashlib
+import logging
+import functools
+import threading
+
+from flask import g
+from flask import request
+from flask import current_app
+from flask import render_template
+
+from flask_caching.backends.filesystemcache import FileSystemCache
+
+from .cache import cache
+
+logger = logging.getLogger(__name__)
+
+_backend_lock = threading.Lock()
+
+# Fixed size hash table of token buckets in a file every worker maps. A
+# bucket lives in one of PROBES slots after the one its key hashes to, so a
+# check reads at most PROBES slots whatever the number of buckets. Expired
+# slots are reused and, once the window is full, the bucket closest to
+# expiry is evicted: a busy attacker's bucket is always the last to go
+class BucketTable:
+    SLOT = struct.Struct("<Qddd")
+    PROBES = 8
+
+    def __init__(self, path, slots):
+        self.slots = slots
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        size = slots * self.SLOT.size
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self.fd).st_size != size:
+                os.ftruncate(self.fd, 0)
+                os.ftruncate(self.fd, size)
+        finally:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+        self.table = mmap.mmap(self.fd, size)
+
+    def take(self, key, burst, rate):
+        digest = hashlib.sha1(key.encode("utf-8")).digest()
+        # Zero marks a slot that was never used
+        key_hash = int.from_bytes(digest[:8], "little") | 1
+        now = time.time()
+        with self.lock:
+            # The thread lock covers the threads of this worker, which share
+            # the file descriptor and so the flock, the flock the workers
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+            try:
+                offset = None
+                tokens = burst
+                victim = None
+                for i in range(self.PROBES):
+                    slot = (key_hash + i) % self.slots * self.SLOT.size
+                    slot_key, slot_tokens, updated, expires = (
+                        self.SLOT.unpack_from(self.table, slot)
+                    )
+                    if slot_key == key_hash and expires > now:
+                        offset = slot
+                        tokens = min(
+                            burst,
+                            slot_tokens + (now - updated) * rate
+                        )
+                        break
+                    if victim is None or expires < victim[1]:
+                        victim = (slot, expires)
+                if offset is None:
+                    offset = victim[0]
+                if tokens < 1:
+                    return math.ceil((1 - tokens) / rate)
+                tokens -= 1
+                self.SLOT.pack_into(
+                    self.table,
+                    offset,
+                    key_hash,
+                    tokens,
+                    now,
+                    now + (burst - tokens) / rate
+                )
+                return 0
+            finally:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+# Buckets in a shared backend with native expiry, like Redis, which unlike
+# the table also works across hosts
+class CacheBuckets:
+    def __init__(self, backend):
+        self.backend = backend
+
+    def take(self, key, burst, rate):
+        now = time.time()
+        bucket = self.backend.get(key)
+        if bucket is None:
+            tokens = burst
+        else:
+            tokens, updated = bucket
+            tokens = min(burst, tokens + (now - updated) * rate)
+        if tokens < 1:
+            return math.ceil((1 - tokens) / rate)
+        # Not atomic, concurrent attempts may both spend the last token,
+        # which only matters for a handful of requests at the edge of the
+        # limit
+        tokens -= 1
+        self.backend.set(
+            key,
+            (tokens, now),
+            timeout=math.ceil((burst - tokens) / rate)
+        )
+        return 0
+
+def _get_backend():
+    # A FileSystemCache has no cheap expiry: once full, every set scans
+    # every file. Each worker maps the bucket table instead, after a fork
+    # too since the file lock belongs to the open file
+    app = current_app._get_current_object()
+    entry = app.extensions.get("pcarrot_ratelimit")
+    if entry is None or entry[0] != os.getpid():
+        with _backend_lock:
+            entry = app.extensions.get("pcarrot_ratelimit")
+            if entry is None or entry[0] != os.getpid():
+                shared = getattr(cache.cache, "shared", cache.cache)
+                if isinstance(shared, FileSystemCache):
+                    backend = BucketTable(
+                        app.config["OT_RATE_LIMIT_FILE"],
+                        app.config["OT_RATE_LIMIT_MAX_BUCKETS"]
+                    )
+                else:
+                    backend = CacheBuckets(shared)
+                entry = (os.getpid(), backend)
+                app.extensions["pcarrot_ratelimit"] = entry
+    return entry[1]
+
+def consume(scope, identity, burst, per_minute):
+    # Token bucket: holds up to burst tokens and refills per_minute of them
+    # every minute. Returns 0 if a token was taken or the seconds to wait
+    identity = hashlib.sha1(str(identity).lower().encode("utf-8")).hexdigest()
+    key = f"pcarrot.ratelimit.{scope}.{identity}"
+    return _get_backend().take(key, burst, per_minute / 60)
+
+def _get_limits():
+    config = current_app.config
+    limits = [(
+        "ip",
+        request.remote_addr,
+        config["OT_RATE_LIMIT_IP_BURST"],
+        config["OT_RATE_LIMIT_IP_PER_MINUTE"]
+    )]
+    account = request.form.get("account_name") or g.get("account_id")
+    if account:
+        limits.append((
+            "account",
+            account,
+            config["OT_RATE_LIMIT_ACCOUNT_BURST"],
+            config["OT_RATE_LIMIT_ACCOUNT_PER_MINUTE"]
+        ))
+    return limits
+
+def rate_limited(view):
+    # Checked before the form is built, so throttled attempts never reach
+    # the CSRF check, the password hashing or MySQL
+    @functools.wraps(view)
+    def wrapped_view(**kwargs):
+        if request.method != "POST" or not current_app.config["OT_RATE_LIMIT"]:
+            return view(**kwargs)
+        try:
+            retry_after = max(
+                consume(*limit) for limit in _get_limits()
+            )
+        except Exception:
+            logger.exception("Exception possibly due to cache backend.")
+            retry_after = 0
+        if retry_after:
+            return (
+                render_template("rate_limited.html", retry_after=retry_after),
+                429,
+                {"Retry-After": str(retry_after)}
+            )
+        return view(**kwargs)
+    return wrapped_view
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# MIT License
+#
+# Copyright (c) 2023 Iñaki Amatria-Barral
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import time
+import click
+import threading
+
+from flask import current_app
+
+from jinja2 import FileSystemBytecodeCache
+
+def enable_bytecode_cache(app):
+    directory = os.path.join(app.instance_path, "jinja")
+    os.makedirs(directory, exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(directory)
+
+def warm_up_templates(app):
+    # Compiles every template now (or loads it from the bytecode cache) so
+    # the first request of the worker does not pay for it
+    for name in app.jinja_env.list_templates(extensions=("html", )):
+        app.jinja_env.get_template(name)
+
+def get_startup_timings(app=None):
+    app = app or current_app
+    return dict(app.extensions["pcarrot_startup"])
+
+def init_app(app, imports, app_setup):
+    # app_setup covers create_app up to here: the config, the imports of the
+    # pCarrot modules and the init_app of each of them
+    timings = app.extensions["pcarrot_startup"] = {
+        "imports": imports,
+        "app_setup": app_setup
+    }
+
+    if app.config["OT_FAST_START"]:
+        enable_bytecode_cache(app)
+        warm_up = time.perf_counter()
+        warm_up_templates(app)
+        timings["template_warm_up"] = time.perf_counter() - warm_up
+
+    first_request = threading.Lock()
+
+    @app.before_request
+    def start_first_request_timer():
+        if "first_request" not in timings and first_request.acquire(False):
+            timings["first_request_start"] = time.perf_counter()
+
+    @app.after_request
+    def stop_first_request_timer(response):
+        if "first_request" not in timings and "first_request_start" in timings:
+            timings["first_request"] = (
+                time.perf_counter() - timings.pop("first_request_start")
+            )
+        return response
+
+    app.cli.add_command(startup_report_command)
+
+@click.command("startup-report", help="Report how long a worker takes to start.")
+@click.option(
+    "--path",
+    default="/login",
+    show_default=True,
+    help="Path of the first request."
+)
+def startup_report_command(path):
+    app = current_app._get_current_object()
+    app.test_client().get(path)
+    for phase, seconds in get_startup_timings(app).items():
+        click.echo(f"{phase:<18} {seconds * 1000:>9.2f} ms")
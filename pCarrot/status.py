@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# MIT License
+#
+# Copyright (c) 2023 Iñaki Amatria-Barral
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import time
+import struct
+import asyncio
+import logging
+import threading
+
+from flask import Blueprint
+from flask import render_template
+
+from .cache import cache
+
+logger = logging.getLogger(__name__)
+
+REQUEST_MISC_SERVER_INFO = 0x04
+REQUEST_PLAYERS_INFO = 0x08
+REQUEST_EXT_PLAYERS_INFO = 0x20
+
+STATUS_KEY = "pcarrot.status"
+STATUS_POLLER_KEY = "pcarrot.status.poller"
+
+# Seconds a worker reuses the snapshot it read before reading it again
+STATUS_MAX_AGE = 1
+
+class StatusProtocolError(Exception): ...
+
+class _StatusMessage:
+    def __init__(self, data):
+        self.data = data
+        self.position = 0
+
+    def _unpack(self, fmt):
+        size = struct.calcsize(fmt)
+        if self.position + size > len(self.data):
+            raise StatusProtocolError("Truncated status message")
+        value, = struct.unpack_from(fmt, self.data, self.position)
+        self.position += size
+        return value
+
+    def get_byte(self):
+        return self._unpack("<B")
+
+    def get_u32(self):
+        return self._unpack("<I")
+
+    def get_u64(self):
+        return self._unpack("<Q")
+
+    def get_string(self):
+        size = self._unpack("<H")
+        value = self.data[self.position:self.position + size]
+        if len(value) != size:
+            raise StatusProtocolError("Truncated status message")
+        self.position += size
+        return value.decode("latin-1")
+
+    def done(self):
+        return self.position >= len(self.data)
+
+def parse_status(data):
+    status = {
+        "online": True,
+        "uptime": None,
+        "players_online": 0,
+        "players_max": 0,
+        "players_peak": 0,
+        "players": []
+    }
+    msg = _StatusMessage(data)
+    while not msg.done():
+        kind = msg.get_byte()
+        if kind == 0x12:
+            msg.get_string()
+            msg.get_string()
+            msg.get_string()
+            status["uptime"] = msg.get_u64()
+        elif kind == 0x20:
+            status["players_online"] = msg.get_u32()
+            status["players_max"] = msg.get_u32()
+            status["players_peak"] = msg.get_u32()
+        elif kind == 0x21:
+            status["players"] = [
+                (msg.get_string(), msg.get_u32())
+                for _ in range(msg.get_u32())
+            ]
+        else:
+            raise StatusProtocolError(f"Unexpected status block {kind:#x}")
+    return status
+
+async def query_status(host, port, timeout):
+    reader, writer = await asyncio.wait_for(
+        asyncio.open_connection(host, port),
+        timeout
+    )
+    try:
+        payload = struct.pack(
+            "<BBH",
+            0xFF,
+            0x01,
+            REQUEST_MISC_SERVER_INFO | REQUEST_PLAYERS_INFO
+            | REQUEST_EXT_PLAYERS_INFO
+        )
+        writer.write(struct.pack("<H", len(payload)) + payload)
+        await writer.drain()
+        header = await asyncio.wait_for(reader.readexactly(2), timeout)
+        size, = struct.unpack("<H", header)
+        data = await asyncio.wait_for(reader.readexactly(size), timeout)
+    finally:
+        writer.close()
+    return parse_status(data)
+
+def get_status():
+    try:
+        return cache.get_durable(STATUS_KEY, STATUS_MAX_AGE)
+    except Exception:
+        logger.exception("Exception possibly due to cache backend.")
+        return None
+
+def get_poll_delay(interval, failures, max_backoff):
+    # Backs off exponentially while the game server does not answer
+    if not failures:
+        return interval
+    return min(interval * 2 ** failures, max_backoff)
+
+class StatusPoller:
+    def __init__(self, app):
+        self.app = app
+        self.pid = None
+        self.owner = None
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        # Threads do not survive a fork, every worker needs its own poller
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            self.owner = os.urandom(8).hex()
+            self.thread = threading.Thread(
+                target=asyncio.run,
+                args=(self._run(), ),
+                name="pcarrot-status-poller",
+                daemon=True
+            )
+            self.thread.start()
+
+    async def _poll(self, config, failures):
+        try:
+            status = await query_status(
+                config["OT_STATUS_HOST"],
+                config["OT_STATUS_PORT"],
+                config["OT_STATUS_TIMEOUT"]
+            )
+        except (OSError, EOFError, asyncio.TimeoutError, StatusProtocolError):
+            logger.warning("The game server did not answer the status request")
+            return {"online": False, "players": []}, failures + 1
+        return status, 0
+
+    async def _run(self):
+        config = self.app.config
+        interval = config["OT_STATUS_INTERVAL"]
+        failures = 0
+        while True:
+            delay = interval
+            try:
+                # Only one worker polls the game server every interval, the
+                # rest just read the snapshot it leaves in the cache
+                with self.app.app_context():
+                    leader = cache.acquire_lease(
+                        STATUS_POLLER_KEY,
+                        self.owner,
+                        interval,
+                        cache.durable
+                    )
+                if leader:
+                    status, failures = await self._poll(config, failures)
+                    status["updated"] = time.time()
+                    delay = get_poll_delay(
+                        interval,
+                        failures,
+                        config["OT_STATUS_MAX_BACKOFF"]
+                    )
+                    with self.app.app_context():
+                        # Outlives a few missed polls, then the header
+                        # honestly says the status is unknown
+                        cache.durable.set(STATUS_KEY, status, timeout=3 * delay)
+                        cache.acquire_lease(
+                            STATUS_POLLER_KEY,
+                            self.owner,
+                            delay,
+                            cache.durable
+                        )
+            except Exception:
+                logger.exception("Unexpected error in the status poller")
+            await asyncio.sleep(delay)
+
+bp = Blueprint("status", __name__)
+
+@bp.route("/status")
+def index():
+    return render_template("status/index.html", status=get_status())
+
+def init_app(app):
+    poller = StatusPoller(app)
+
+    @app.before_request
+    def start_status_poller():
+        if app.config["OT_STATUS_POLLER"] and poller.pid != os.getpid():
+            poller.start()
+
+    @app.context_processor
+    def inject_server_status():
+        return {"server_status": get_status()}
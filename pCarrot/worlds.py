@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# MIT License
+#
+# Copyright (c) 2023 Iñaki Amatria-Barral
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import time
+import logging
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from flask import g
+from flask import request
+from flask import current_app
+
+from .db import get_world
+from .db import get_worlds
+from .db import get_home_world
+from .db import get_world_target
+
+logger = logging.getLogger(__name__)
+
+_executor_lock = threading.Lock()
+
+class WorldBusyError(Exception): ...
+
+class WorldExecutor:
+    # Every world has its own threads, so a hung world can only tie up its
+    # own. Once all of them are busy the world is skipped right away rather
+    # than queueing more work behind the hung tasks
+    def __init__(self, world, workers):
+        self.world = world
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers,
+            thread_name_prefix=f"pcarrot-world-{world}"
+        )
+        self.slots = threading.BoundedSemaphore(workers)
+
+    def submit(self, f, *args):
+        if not self.slots.acquire(blocking=False):
+            raise WorldBusyError(f"World {self.world} is still busy")
+        try:
+            future = self.executor.submit(f, *args)
+        except Exception:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda _: self.slots.release())
+        return future
+
+def get_world_executor(world):
+    app = current_app._get_current_object()
+    entry = app.extensions.get("pcarrot_worlds")
+    if entry is None or entry[0] != os.getpid() or world not in entry[1]:
+        with _executor_lock:
+            entry = app.extensions.get("pcarrot_worlds")
+            if entry is None or entry[0] != os.getpid():
+                entry = (os.getpid(), {})
+                app.extensions["pcarrot_worlds"] = entry
+            if world not in entry[1]:
+                entry[1][world] = WorldExecutor(
+                    world,
+                    app.config["OT_WORLD_WORKERS"]
+                )
+    return entry[1][world]
+
+def _run_in_world(app, world, f, args, kwargs):
+    with app.app_context():
+        g.world = world
+        return f(*args, **kwargs)
+
+def fan_out(f, *args, worlds=None, **kwargs):
+    # Runs f once per world in parallel. Returns the results of the worlds
+    # that answered in time and the list of the ones that did not, so a
+    # slow or unreachable world degrades the page instead of stalling it
+    app = current_app._get_current_object()
+    config = app.config
+    start = time.monotonic()
+
+    worlds = list(worlds or get_worlds())
+    futures = {}
+    failed = []
+    for world in worlds:
+        try:
+            futures[world] = get_world_executor(world).submit(
+                _run_in_world, app, world, f, args, kwargs
+            )
+        except WorldBusyError:
+            logger.warning("World %s is busy, skipped", world)
+            failed.append(world)
+
+    results = {}
+    for world, future in futures.items():
+        timeout = get_world_target(world).get(
+            "timeout",
+            config["OT_WORLD_TIMEOUT"]
+        )
+        try:
+            results[world] = future.result(
+                max(start + timeout - time.monotonic(), 0)
+            )
+        except FutureTimeoutError:
+            logger.warning("World %s did not answer in %ss", world, timeout)
+            failed.append(world)
+        except Exception:
+            logger.exception("World %s failed", world)
+            failed.append(world)
+    return results, sorted(failed, key=worlds.index)
+
+def init_app(app):
+    # ?world= picks the world of the pages that show a single one, and
+    # url_for keeps it on every link from there on
+    @app.before_request
+    def select_world():
+        world = request.args.get("world")
+        if world is not None and world in get_worlds():
+            g.world = world
+
+    @app.url_defaults
+    def add_world(endpoint, values):
+        world = g.get("world")
+        if world is not None and endpoint != "static":
+            if values.get("world") is None:
+                values["world"] = world
+
+    @app.context_processor
+    def inject_worlds():
+        return {
+            "worlds": get_worlds(),
+            "current_world": get_world(),
+            "home_world": get_home_world()
+        }
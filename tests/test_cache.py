@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# MIT License
+#
+# Copyright (c) 2023 Iñaki Amatria-Barral
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import time
+
+from pCarrot import create_app
+from pCarrot.cache import cache
+
+def test_stale_refresh_retries_after_failure(tmp_path):
+    app = create_app({
+        "TESTING": True,
+        "OT_STATUS_POLLER": False,
+        "CACHE_DIR": str(tmp_path / "cache"),
+        "CACHE_DURABLE_DIR": str(tmp_path / "durable")
+    })
+    calls = []
+    failing = []
+
+    @cache.memoize(timeout=1, stale_timeout=1000)
+    def double(x):
+        calls.append(x)
+        if failing:
+            raise RuntimeError("The database is down")
+        return 2 * x
+
+    with app.app_context():
+        assert double(2) == 4
+        time.sleep(1.1)
+        failing.append(True)
+        # The refresh fails, the stale value is served
+        assert double(2) == 4
+        assert len(calls) == 2
+        failing.clear()
+        # Once the retry timeout passes the next caller refreshes again
+        time.sleep(1.1)
+        assert double(2) == 4
+        assert len(calls) == 3
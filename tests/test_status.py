@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# MIT License
+#
+# Copyright (c) 2023 Iñaki Amatria-Barral
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import time
+import struct
+import asyncio
+import threading
+import socketserver
+
+import pytest
+
+from pCarrot import create_app
+from pCarrot.status import get_status
+from pCarrot.status import StatusPoller
+from pCarrot.status import parse_status
+from pCarrot.status import query_status
+from pCarrot.status import get_poll_delay
+from pCarrot.status import StatusProtocolError
+
+def _string(value):
+    value = value.encode("latin-1")
+    return struct.pack("<H", len(value)) + value
+
+STATUS_PACKET = (
+    b"\x12" + _string("pCarrot") + _string("Earth") + _string("localhost")
+    + struct.pack("<Q", 7322)
+    + b"\x20" + struct.pack("<III", 2, 100, 5)
+    + b"\x21" + struct.pack("<I", 2)
+    + _string("Alice") + struct.pack("<I", 10)
+    + _string("Bob") + struct.pack("<I", 20)
+)
+
+async def _serve_status(reader, writer):
+    size, = struct.unpack("<H", await reader.readexactly(2))
+    request = await reader.readexactly(size)
+    assert request[:2] == b"\xff\x01"
+    writer.write(struct.pack("<H", len(STATUS_PACKET)) + STATUS_PACKET)
+    await writer.drain()
+    writer.close()
+
+async def _query_fake_server():
+    server = await asyncio.start_server(_serve_status, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    async with server:
+        return await query_status("127.0.0.1", port, 5)
+
+def test_parse_status():
+    status = parse_status(STATUS_PACKET)
+    assert status["online"]
+    assert status["uptime"] == 7322
+    assert status["players_online"] == 2
+    assert status["players_max"] == 100
+    assert status["players_peak"] == 5
+    assert status["players"] == [("Alice", 10), ("Bob", 20)]
+
+def test_parse_truncated_status():
+    with pytest.raises(StatusProtocolError):
+        parse_status(STATUS_PACKET[:-3])
+
+def test_parse_unknown_block():
+    with pytest.raises(StatusProtocolError):
+        parse_status(b"\x99")
+
+def test_query_status():
+    status = asyncio.run(_query_fake_server())
+    assert status["players_online"] == 2
+    assert status["players"] == [("Alice", 10), ("Bob", 20)]
+
+def test_poll_offline_server():
+    async def poll():
+        # Bind and close a socket so nobody listens on its port
+        server = await asyncio.start_server(_serve_status, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        server.close()
+        await server.wait_closed()
+        config = {
+            "OT_STATUS_HOST": "127.0.0.1",
+            "OT_STATUS_PORT": port,
+            "OT_STATUS_TIMEOUT": 1
+        }
+        return await StatusPoller(None)._poll(config, 2)
+
+    status, failures = asyncio.run(poll())
+    assert not status["online"]
+    assert failures == 3
+
+def test_poll_delay_backs_off():
+    assert get_poll_delay(60, 0, 600) == 60
+    assert get_poll_delay(60, 1, 600) == 120
+    assert get_poll_delay(60, 2, 600) == 240
+    assert get_poll_delay(60, 5, 600) == 600
+
+class _StatusHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        self.server.polls += 1
+        size, = struct.unpack("<H", self.request.recv(2))
+        self.request.recv(size)
+        self.request.sendall(
+            struct.pack("<H", len(STATUS_PACKET)) + STATUS_PACKET
+        )
+
+def test_poller_keeps_polling(tmp_path):
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), _StatusHandler)
+    server.polls = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        app = create_app({
+            "TESTING": True,
+            "OT_STATUS_POLLER": False,
+            "OT_STATUS_HOST": "127.0.0.1",
+            "OT_STATUS_PORT": server.server_address[1],
+            "OT_STATUS_INTERVAL": 1,
+            "CACHE_DIR": str(tmp_path / "cache"),
+            "CACHE_DURABLE_DIR": str(tmp_path / "durable")
+        })
+        # Two workers, only one of them polls at a time
+        for _ in range(2):
+            StatusPoller(app).start()
+        time.sleep(3.5)
+        with app.app_context():
+            status = get_status()
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert 3 <= server.polls <= 5
+    assert status is not None and status["online"]